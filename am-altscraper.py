@@ -27,6 +27,7 @@
 import sys, os, hashlib
 import json, binascii, argparse, collections, glob
 import systems, importlib
+from classes.platforms import Platforms
 import requests
 import json, base64
 import subprocess
@@ -34,6 +35,7 @@ import zipfile
 import py7zr
 import logging
 from classes.rom import Rom
+from classes.romcache import RomHashCache
 
 #reload(sys)
 #sys.setdefaultencoding("utf-8")
@@ -231,6 +233,7 @@ class Scrapper:
 			initialRomlistCount = len(romlistData)
 		if not args.no_romlist_update: f = open(romlistFile, 'w')
 
+		hashCache = RomHashCache()
 		romsTotalNumber = len(files)
 		logging.info('Found %d roms' % romsTotalNumber)
 		if not args.no_romlist_update: f.write("#Name;Title;Emulator;CloneOf;Year;Manufacturer;Category;Players;Rotation;Control;Status;DisplayCount;DisplayType;AltRomname;AltTitle;Extra;Buttons;Series;Language;Region;Rating\n")
@@ -240,8 +243,7 @@ class Scrapper:
 			logging.info('Getting info for ' + rom)
 			base = os.path.basename(rom)
 			name = os.path.splitext(base)[0]
-			romobj = Rom(rom)
-			romobj.getCRC()
+			romobj = Rom(rom, hashCache=hashCache)
 			logging.debug(str(repr(romobj)))
 			logging.debug(romobj)
 			romFound = False
@@ -391,12 +393,15 @@ class Scrapper:
 		url = 'https://www.screenscraper.fr/api2/jeuInfos.php?devid=substring&devpassword=' + base64.b64decode('aE9YdDJXYUJJM2Y=').decode('ascii','strict') + '&softname=GroovyScrape&output=json'
 		if args.user and args.password:
 			url += '&ssid={}&sspassword={}'.format(args.user, args.password)
-		if not args.system in ['mame', 'arcade', 'mame-libretro', 'mame4all', 'fba']:
+		systemId = Platforms.platformId(args.system, 'ScreenScraper')
+		if not Platforms.isArcade(args.system):
 			for req_type in [ 'crc', 'md5', 'romnom']:
 				if req_type == 'crc': req_val = rom.crc
 				if req_type == 'md5': req_val = rom.md5
 				if req_type == 'romnom': req_val = rom.romfile
 				specific_url = url + '&{}={}'.format(req_type, req_val)
+				if systemId:
+					specific_url += '&systemeid=' + systemId
 				r = requests.get(specific_url)
 				if r.status_code == 200:
 					logging.debug(rom.romfile + ': URL returned status code ' + str(r.status_code) + ' using ' + req_type)
@@ -405,8 +410,7 @@ class Scrapper:
 				else:
 					logging.error(rom.romfile + ': URL returned status code ' + str(r.status_code) + ' using ' + req_type)
 		else:
-			# Force system id to 75 (MAME/arcade)
-			url += '&systemeid=75&romnom=' + rom.romfile  # This should be someday improved
+			url += '&systemeid={}&romnom={}'.format(systemId, rom.romfile)
 			r = requests.get(url)
 			if r.status_code == 200:
 				root = json.loads(r.text)
@@ -0,0 +1,51 @@
+"""Common helpers for the persistent caches stored in ~/.cache/altscraper"""
+
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+
+def cacheFolder() -> str:
+    cacheDir = ''
+    if sys.platform == 'win32':
+        cacheDir = os.path.expanduser('%LOCALAPPDATA%')
+    # Common Linux/MacOS
+    else:
+        cacheDir = os.path.expanduser('~')
+    cacheDir += '/.cache/altscraper'
+    if not os.path.exists(cacheDir):
+        logging.debug('Creating cache folder ' + cacheDir)
+        os.makedirs(cacheDir)
+    return cacheDir
+
+
+class SqliteCache:
+    """A SQLite database in the cache folder, safe to share between threads"""
+    def __init__(self, fileName: str, schema: str):
+        self.dbFile = cacheFolder() + '/' + fileName
+        self.lock = threading.Lock()
+        logging.debug('Opening cache database ' + self.dbFile)
+        self.db = sqlite3.connect(self.dbFile, check_same_thread=False)
+        with self.lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript(schema)
+            self.db.commit()
+
+    def execute(self, query: str, params=()) -> list:
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+            self.db.commit()
+        return rows
+
+    def executeMany(self, query: str, rows):
+        """Runs query for each params of rows in a single transaction"""
+        with self.lock:
+            self.db.executemany(query, rows)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
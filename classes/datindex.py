@@ -0,0 +1,98 @@
+"""Arcade metadata index built from MAME -listxml output and Logiqx DATs (FBNeo, ...)
+
+The XML files are stream-parsed: a full MAME -listxml is several hundreds of MB,
+only the machine being read is kept in memory.
+"""
+
+import logging
+import xml.etree.ElementTree as ElementTree
+from classes.cache import SqliteCache
+
+DATINDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    name TEXT PRIMARY KEY,
+    description TEXT,
+    year TEXT,
+    manufacturer TEXT,
+    cloneof TEXT,
+    rotate INTEGER,
+    players TEXT,
+    source TEXT
+);
+"""
+
+# MAME -listxml uses machine, older MAME and Logiqx DATs use game
+GameTags = ['machine', 'game']
+# Rows inserted per transaction while importing
+ImportBatchSize = 5000
+
+
+def parseGame(elem) -> dict:
+    """The interesting part of a machine/game element, rotate is None when the DAT doesn't tell it"""
+    rotate = None
+    display = elem.find('display')
+    video = elem.find('video')
+    if display is not None:
+        rotate = int(display.get('rotate', 0) or 0)
+    elif video is not None:
+        # Logiqx DATs only tell the screen orientation
+        rotate = 90 if video.get('orientation') == 'vertical' else int(video.get('rotate', 0) or 0)
+    inputs = elem.find('input')
+    return {'name': elem.get('name'),
+        'description': elem.findtext('description', ''),
+        'year': elem.findtext('year', ''),
+        'manufacturer': elem.findtext('manufacturer', ''),
+        'cloneof': elem.get('cloneof', ''),
+        'rotate': rotate,
+        'players': inputs.get('players', '') if inputs is not None else ''}
+
+
+def iterDatGames(path: str):
+    """Yields the games of a MAME -listxml or Logiqx DAT, skipping devices and non runnable machines"""
+    context = ElementTree.iterparse(path, events=('start', 'end'))
+    root = None
+    for event, elem in context:
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag not in GameTags:
+            continue
+        if elem.get('isdevice') != 'yes' and elem.get('runnable') != 'no' and elem.get('name'):
+            yield parseGame(elem)
+        # Drop the parsed element and its children, they are referenced by root
+        elem.clear()
+        root.clear()
+
+
+class DatIndex(SqliteCache):
+    """Arcade games metadata keyed on the romset name"""
+    def __init__(self, fileName: str = 'arcadedat.db'):
+        super().__init__(fileName, DATINDEX_SCHEMA)
+
+    def importDat(self, path: str) -> int:
+        """Adds or replaces the games of a DAT, returns how many were imported"""
+        count = 0
+        batch = []
+        query = 'INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+        for g in iterDatGames(path):
+            batch.append((g['name'], g['description'], g['year'], g['manufacturer'], g['cloneof'],
+                g['rotate'], g['players'], path))
+            if len(batch) >= ImportBatchSize:
+                self.executeMany(query, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.executeMany(query, batch)
+            count += len(batch)
+        logging.info('%d games imported from %s', count, path)
+        return count
+
+    def lookup(self, name: str) -> dict | None:
+        rows = self.execute('SELECT name, description, year, manufacturer, cloneof, rotate, players FROM games WHERE name = ?', (name,))
+        if not rows:
+            return None
+        return dict(zip(['name', 'description', 'year', 'manufacturer', 'cloneof', 'rotate', 'players'], rows[0]))
+
+    def count(self) -> int:
+        return self.execute('SELECT COUNT(*) FROM games')[0][0]
@@ -0,0 +1,173 @@
+"""Identification helpers for CD/GD-ROM disc images
+
+A cue, gdi or m3u file is just a few lines of text that no database knows about:
+the hashes that matter are the ones of the data track they point to. CHD files
+embed the SHA1 of their content in their header, no need to read the rest.
+"""
+
+import logging
+import os
+import re
+import struct
+
+# Extensions that describe a disc image stored in other files
+DescriptorExtensions = ['cue', 'gdi', 'm3u']
+
+# "Game (Disc 1)", "Game (Disc 1 of 3)", "Game [CD2]", "Game (Disk B)" ... CD only takes
+# a single digit, not to read platform tags like (CD32) as disc numbers
+DiscPattern = re.compile(r'\s*[\(\[](?:dis[ck]\s*([0-9]+|[a-z])|cd\s*([0-9]))(?:\s*of\s*[0-9]+)?[\)\]]', re.IGNORECASE)
+
+# Parsed with regexes, not shlex: a cue REM line can hold a lone quote
+CueFilePattern = re.compile(r'\s*FILE\s+(?:"([^"]*)"|(\S+))', re.IGNORECASE)
+CueTrackPattern = re.compile(r'\s*TRACK\s+\d+\s+(\S+)', re.IGNORECASE)
+# track_number lba type(4 = data, 0 = audio) sector_size file offset
+GdiTrackPattern = re.compile(r'\s*(\d+)\s+\d+\s+(\d+)\s+\d+\s+(?:"([^"]*)"|(\S+))')
+
+ChdMagic = b'MComprHD'
+# Offset of the (raw + metadata) SHA1 in the header, per CHD version
+ChdSha1Offsets = {3: 80, 4: 48, 5: 84}
+
+
+def readChdSha1(path: str) -> str | None:
+    """Reads the SHA1 stored in a CHD header. That is the one MAME DATs reference"""
+    with open(path, 'rb') as f:
+        header = f.read(124)
+    if len(header) < 16 or header[0:8] != ChdMagic:
+        logging.warning('%s is not a CHD file', path)
+        return None
+    length, version = struct.unpack('>II', header[8:16])
+    if version not in ChdSha1Offsets:
+        logging.warning('%s: unsupported CHD version %d', path, version)
+        return None
+    offset = ChdSha1Offsets[version]
+    return header[offset:offset + 20].hex()
+
+
+def cueDataTrack(path: str) -> str | None:
+    """Returns the file holding the first data track of a cue sheet"""
+    files = []
+    currentFile = None
+    with open(path, errors='replace') as f:
+        for line in f:
+            fileMatch = CueFilePattern.match(line)
+            if fileMatch:
+                currentFile = fileMatch.group(1) if fileMatch.group(1) is not None else fileMatch.group(2)
+                files.append(currentFile)
+                continue
+            trackMatch = CueTrackPattern.match(line)
+            if trackMatch and currentFile and trackMatch.group(1).upper() != 'AUDIO':
+                return currentFile
+    return files[0] if files else None
+
+
+def gdiDataTrack(path: str) -> str | None:
+    """Returns the file of the 1st high density data track of a gdi
+
+    Track 1 is the low density area, nearly the same on every GD-ROM. The game
+    data lives in track 3.
+    """
+    tracks = dict()
+    with open(path, errors='replace') as f:
+        lines = [l.strip() for l in f if l.strip()]
+    # First line is the number of tracks
+    for line in lines[1:]:
+        match = GdiTrackPattern.match(line)
+        if not match:
+            continue
+        tracks[int(match.group(1))] = (match.group(2), match.group(3) if match.group(3) is not None else match.group(4))
+    if 3 in tracks and tracks[3][0] == '4':
+        return tracks[3][1]
+    for n in sorted(tracks):
+        if tracks[n][0] == '4':
+            return tracks[n][1]
+    return None
+
+
+def m3uFirstDisc(path: str) -> str | None:
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line and line[0] != '#':
+                return line
+    return None
+
+
+def resolveDataTrack(path: str) -> str:
+    """Follows cue/gdi/m3u references down to the file that should be hashed"""
+    seen = set()
+    while os.path.splitext(path)[1][1:].lower() in DescriptorExtensions and path not in seen:
+        seen.add(path)
+        ext = os.path.splitext(path)[1][1:].lower()
+        if ext == 'cue':
+            target = cueDataTrack(path)
+        elif ext == 'gdi':
+            target = gdiDataTrack(path)
+        else:
+            target = m3uFirstDisc(path)
+        if not target:
+            logging.warning("%s doesn't reference any track", path)
+            break
+        target = os.path.join(os.path.dirname(path), target)
+        if not os.path.exists(target):
+            logging.warning("%s references %s which doesn't exist", path, target)
+            break
+        path = target
+    return path
+
+
+def m3uDiscs(path: str) -> list:
+    """All the discs listed in a m3u playlist, as paths"""
+    discs = []
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line and line[0] != '#':
+                discs.append(os.path.normpath(os.path.join(os.path.dirname(path), line)))
+    return discs
+
+
+def discNumber(path: str) -> tuple | None:
+    """(game key, disc number) of a file named after a disc of a game, None otherwise"""
+    name, ext = os.path.splitext(os.path.basename(path))
+    match = DiscPattern.search(name)
+    if not match:
+        return None
+    number = match.group(1) or match.group(2)
+    number = int(number) if number.isdigit() else ord(number.lower()) - ord('a') + 1
+    gameName = name[:match.start()] + name[match.end():]
+    return ((os.path.dirname(path), gameName.strip().lower(), ext.lower()), number)
+
+
+def groupDiscs(files: list) -> dict:
+    """Groups the discs of a same game: first disc (or m3u playlist) -> the other files of the game
+
+    Files that are not part of a multi discs game are their own group.
+    """
+    groups = dict()
+    grouped = set()
+    normalized = {os.path.normpath(f): f for f in files}
+    # A playlist is the entry the frontend should launch, its discs follow it
+    for f in files:
+        if os.path.splitext(f)[1][1:].lower() != 'm3u':
+            continue
+        try:
+            discs = [normalized[d] for d in m3uDiscs(f) if d in normalized and normalized[d] != f]
+        except OSError as e:
+            logging.warning("Couldn't read %s: %s", f, e)
+            continue
+        groups[f] = [d for d in discs if d not in grouped]
+        grouped.add(f)
+        grouped.update(discs)
+    byGame = dict()
+    for f in files:
+        if f in grouped:
+            continue
+        disc = discNumber(f)
+        if disc:
+            byGame.setdefault(disc[0], []).append((disc[1], f))
+        else:
+            groups[f] = []
+    for discs in byGame.values():
+        discs.sort()
+        groups[discs[0][1]] = [f for _, f in discs[1:]]
+    return groups
@@ -1,5 +1,8 @@
 #import json
+import copy
+import functools
 import logging
+import sys
 #import os
 #import requests
 #import sys
@@ -14,6 +17,17 @@ Regions = ['wor', 'jp', 'eu', 'us', 'en', 'ss', 'fr', 'de', 'it', 'es', 'pt', 'a
 # fr would go : fr, eu, wor ...
 # us would go : us, wor, jp ...
 
+
+def internString(value):
+    """Single shared copy of the strings repeated on every media, other values as is"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@functools.lru_cache(maxsize=None)
+def regionPriority(lang: str) -> tuple:
+    """Regions to look a media for, in order, when lang is expected. Medias with no region come last"""
+    return tuple(dict.fromkeys([lang] + Regions + ['']))
+
 # Scraper child classes will have to translate that to the name of the type used by the media DB
 class Asset(IntEnum):
     SCREENSHOT = 0
@@ -29,14 +43,31 @@ class Asset(IntEnum):
 
 
 class Media:
+    # Games carry dozens of medias and a romlist thousands of games: no per instance
+    # __dict__, and the hashes are plain slots exposed as a dict
+    __slots__ = ('type', 'crc32', 'md5', 'sha1', 'url', 'extension', 'region', 'scraperMediaType')
+
     def __init__(self):
         self.type: int # Asset type, see the Asset enum class
-        self.hashes = {'crc32': None, 'md5': None, 'sha1': None}
+        self.crc32 = None
+        self.md5 = None
+        self.sha1 = None
         self.url = ""
         self.extension = '' # png, jpg, mp4 ...
         self.region = ''
         self.scraperMediaType = None
 
+    @property
+    def hashes(self) -> dict:
+        """A copy: assign a new dict to change the hashes"""
+        return {'crc32': self.crc32, 'md5': self.md5, 'sha1': self.sha1}
+
+    @hashes.setter
+    def hashes(self, hashes: dict):
+        self.crc32 = hashes.get('crc32')
+        self.md5 = hashes.get('md5')
+        self.sha1 = hashes.get('sha1')
+
     def __str__(self):
         return "Media:\n  Type: {}\n  URL: {}\n  Extension: {}\n  Region: {}\n  Hashes: {}\n  Media type: {}\n".format(Asset(self.type).name, self.url, self.extension, self.region, self.hashes, self.scraperMediaType)
 
@@ -57,12 +88,16 @@ class FilteredGameInfo(TypedDict):
     medias: list[Media]
 
 class GameInfo:
+    __slots__ = ('title', 'description', 'date', 'category', '_medias', '_mediaIndex', 'cloneof',
+        'developer', 'publisher', 'players', 'resolution', 'rotation')
+
     def __init__(self):
         # The next dicts are region: value
         self.title = dict()
         self.description = dict()
         self.date = dict()
         self.category = dict()
+        self._mediaIndex = None
         self.medias = list()
         self.cloneof = ''
         self.developer = ''
@@ -74,6 +109,16 @@ class GameInfo:
     def __str__(self):
         return "GameInfo:\nTitle:{}\nDescription: {}\nDate: {}\nCategory:{}\nCloneOf: {}\nMedia: {}\n".format(self.title, self.description, self.date, self.category, self.cloneof, str(self.medias))
 
+    def derive(self, **overrides) -> 'GameInfo':
+        """A copy of this game info with some fields replaced, like a clone built from its parent"""
+        derived = copy.copy(self)
+        for k in ['title', 'description', 'date', 'category']:
+            setattr(derived, k, dict(getattr(self, k)))
+        derived.medias = list(self.medias)
+        for k, v in overrides.items():
+            setattr(derived, k, v)
+        return derived
+
     def filterDictOnLang(self, lang, dataDict):
         if not dataDict:
             return None
@@ -87,33 +132,43 @@ class GameInfo:
         logging.debug(dataDict)
         raise ValueError("Data has no language {}".format(lang))
 
-    def mediasHaveAsset(self, medias, asset):
+    @property
+    def medias(self) -> list[Media]:
+        return self._medias
+
+    @medias.setter
+    def medias(self, medias: list[Media]):
+        self._medias = medias
+        self._mediaIndex = None
+
+    @staticmethod
+    def indexMedias(medias) -> dict:
+        """(asset type, region) -> the first such media, and asset type -> the first media of this type"""
+        index = dict()
         for m in medias:
-            if m.type == asset:
-                return True
+            index.setdefault((m.type, m.region), m)
+            index.setdefault(m.type, m)
+        return index
+
+    def mediaIndex(self) -> dict:
+        # Built once, a new medias list resets it
+        if self._mediaIndex is None:
+            self._mediaIndex = self.indexMedias(self._medias)
+        return self._mediaIndex
 
     def filterMediaOnLang(self, lang, medias) -> list[Media]:
+        """One media per asset type: the lang one, else the first found in the Regions order"""
+        index = self.mediaIndex() if medias is self._medias else self.indexMedias(medias)
         filteredMedias = list()
-        for m in medias:
-            # logging.debug(m)
-            if m.region == lang:
-                filteredMedias.append(m)
-        # Not all media exist for the required language, so let's look for a default one
-        for name, member in Asset.__members__.items():
-            a = member.value
-            if not self.mediasHaveAsset(medias, a):
+        for asset in Asset:
+            if asset.value not in index:
                 continue
-            logging.debug('Media {} not yet found'.format(name))
-            for r in Regions:
-                foundMedia = False
-                logging.debug('Looking for media {} of region {}'.format(name, r))
-                for m in medias:
-                    if m.type == a and m.region == r:
-                        logging.debug('Found media {} for region {} when region {} was expected'.format(name, r, lang))
-                        foundMedia = True
-                        filteredMedias.append(m)
-                        break
-                if foundMedia:
+            for r in regionPriority(lang):
+                m = index.get((asset.value, r))
+                if m:
+                    if r != lang:
+                        logging.debug('Found media %s for region %s when region %s was expected', asset.name, r, lang)
+                    filteredMedias.append(m)
                     break
         return filteredMedias
 
@@ -126,7 +181,7 @@ class GameInfo:
             publisher=self.publisher,
             players=self.players,
             resolution=self.resolution,
-            rotation=int(self.rotation),
+            rotation=int(self.rotation or 0),
             title=self.filterDictOnLang(lang, self.title),
             description=self.filterDictOnLang(lang, self.description),
             date=self.filterDictOnLang(lang, self.date),
@@ -147,8 +202,8 @@ class GameInfo:
         # return filteredGameInfo
 
     def getAssetMedia(self, assetType: Asset) -> Media | None:
-        for media in self.medias:
-            if media.type == assetType.value:
-                return media
+        media = self.mediaIndex().get(assetType.value)
+        if media:
+            return media
         logging.warning('Game has no such asset %s', assetType)
         return None
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""Chunked, single pass hashing helpers shared by roms and medias"""
+
+import binascii
+import hashlib
+import logging
+import time
+
+# Big enough to keep syscalls overhead low, small enough for a Raspberry Pi
+CHUNK_SIZE = 1024 * 1024
+
+
+class MultiHasher:
+    """Computes CRC32, MD5 and SHA1 at once over data fed by chunks"""
+    def __init__(self, crc: bool = True):
+        self.crc = 0 if crc else None
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        self.startTime = time.monotonic()
+        self.elapsed = 0.0
+
+    def update(self, data: bytes):
+        if self.crc is not None:
+            self.crc = binascii.crc32(data, self.crc)
+        self.md5.update(data)
+        self.sha1.update(data)
+        self.size += len(data)
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.startTime
+        return self
+
+    def hexdigests(self) -> dict:
+        return {'crc': '%08x' % (self.crc & 0xFFFFFFFF) if self.crc is not None else None,
+            'md5': self.md5.hexdigest(),
+            'sha1': self.sha1.hexdigest()}
+
+    def throughput(self) -> float:
+        """MB/s of the last hashing pass"""
+        if not self.elapsed:
+            return 0.0
+        return self.size / (1024 * 1024) / self.elapsed
+
+
+def hashStream(stream, hasher: MultiHasher | None = None) -> MultiHasher:
+    """Feeds a file-like object to a MultiHasher, never holding more than CHUNK_SIZE in memory"""
+    if hasher is None:
+        hasher = MultiHasher()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    return hasher.finish()
+
+
+def hashFile(filename: str, crc: bool = True) -> MultiHasher:
+    with open(filename, 'rb') as f:
+        return hashStream(f, MultiHasher(crc))
+
+
+def fileMatchesHashes(filename: str, hashes: dict) -> bool | None:
+    """Checks a file against crc32/md5/sha1 hashes as given by the scrapers
+
+    Returns None when there is no hash to compare with
+    """
+    expected = {k: v for k, v in hashes.items() if v} if hashes else {}
+    if not expected:
+        return None
+    computed = hashFile(filename).hexdigests()
+    computed['crc32'] = computed['crc']
+    for k, v in expected.items():
+        if k not in computed:
+            continue
+        value = v.lower()
+        if k == 'crc32':
+            value = value.zfill(8)
+        if computed[k] != value:
+            logging.debug('%s: %s is %s, expected %s', filename, k, computed[k], value)
+            return False
+    return True
@@ -0,0 +1,79 @@
+"""Content addressed medias store
+
+Each unique media is stored once, named after its hash. Artwork files are
+hardlinks (or reflinks, or copies as a last resort) to the stored blob, so a
+media shared by several emulators or clones is downloaded and stored once.
+"""
+
+import logging
+import os
+import shutil
+import threading
+from classes.cache import cacheFolder
+
+# crc32 is too weak to name blobs after it
+StoreHashes = ['sha1', 'md5']
+# ioctl to clone a file on copy on write filesystems (btrfs, xfs ...)
+FICLONE = 0x40049409
+
+
+def reflinkFile(src: str, dst: str):
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def linkFile(src: str, dst: str):
+    """Atomically makes dst the same content as src: hardlink, else reflink, else copy"""
+    tmpFile = dst + '.link'
+    if os.path.exists(tmpFile):
+        os.remove(tmpFile)
+    try:
+        os.link(src, tmpFile)
+    except OSError:
+        try:
+            reflinkFile(src, tmpFile)
+        except (OSError, ImportError):
+            shutil.copyfile(src, tmpFile)
+    os.replace(tmpFile, dst)
+
+
+class MediaStore:
+    def __init__(self, root: str = ''):
+        self.root = root or cacheFolder() + '/medias'
+        self.lock = threading.Lock()
+        self.blobLocks = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def blobPath(self, hashes: dict, extension: str) -> str | None:
+        """Where a media is stored, None if it has no usable hash"""
+        if not hashes:
+            return None
+        for h in StoreHashes:
+            if hashes.get(h):
+                value = hashes[h].lower()
+                return '{}/{}/{}/{}.{}'.format(self.root, h, value[0:2], value, extension)
+        return None
+
+    def blobLock(self, blob: str) -> threading.Lock:
+        """Several workers may want the same media at the same time, only one downloads it"""
+        with self.lock:
+            if blob not in self.blobLocks:
+                self.blobLocks[blob] = threading.Lock()
+            return self.blobLocks[blob]
+
+    def has(self, blob: str) -> bool:
+        exists = os.path.exists(blob)
+        with self.lock:
+            if exists:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return exists
+
+    def linkTo(self, blob: str, destination: str):
+        if os.path.exists(destination) and os.path.samefile(blob, destination):
+            return
+        logging.debug('Linking %s to %s', destination, blob)
+        linkFile(blob, destination)
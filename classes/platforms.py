@@ -0,0 +1,94 @@
+"""Systems registry: names, aliases and extensions to systems.py keys and scrapers platform ids"""
+
+import logging
+import threading
+import systems
+
+# Disc images and archives used by many systems, including ones systems.py doesn't know
+GenericExtensions = ['cue', 'm3u', 'iso', 'zip', '7z', 'bin', 'img', 'chd']
+
+
+def normalizeName(name: str) -> str:
+    return ' '.join(str(name).lower().split())
+
+
+class PlatformRegistry:
+    """Indexes systems.py once, so resolving a system never walks the whole list
+
+    Each scraper can add the platforms it knows (from its platforms cache) with
+    indexPlatforms(), to resolve the systems without a hardcoded id.
+    """
+    def __init__(self, systemsData: dict = systems.systems):
+        self.systems = systemsData
+        self.byName = dict()
+        self.byExtension = dict()
+        self.backendIds = dict() # backend -> {normalized name: platform id}
+        self.lock = threading.Lock()
+        for key, data in self.systems.items():
+            for name in [key, data['name']] + data.get('aliases', []):
+                self.byName.setdefault(normalizeName(name), key)
+            for ext in data['exts']:
+                self.byExtension.setdefault(ext.lower(), []).append(key)
+
+    def resolve(self, system: str) -> str | None:
+        """The systems.py key of a system name, alias or AttractMode system value"""
+        if not system:
+            return None
+        # AttractMode can list several ; separated systems
+        for name in str(system).split(';'):
+            key = self.byName.get(normalizeName(name))
+            if key:
+                return key
+        return None
+
+    def isArcade(self, system: str) -> bool:
+        key = self.resolve(system)
+        return bool(key and self.systems[key].get('arcade'))
+
+    def systemsForExtension(self, extension: str) -> list:
+        return self.byExtension.get(extension.lower().lstrip('.'), [])
+
+    def guessSystem(self, extensions: list) -> str | None:
+        """The system of these rom extensions, only when there is no doubt
+
+        Container extensions tell nothing about the system. Every other extension
+        must belong to a single system, the same for all of them. A wrong guess
+        would filter every query on the wrong platform.
+        """
+        guessed = None
+        for ext in extensions:
+            ext = ext.lower().lstrip('.')
+            if ext in GenericExtensions:
+                continue
+            systemsForExt = self.systemsForExtension(ext)
+            if len(systemsForExt) != 1 or (guessed and systemsForExt[0] != guessed):
+                return None
+            guessed = systemsForExt[0]
+        return guessed
+
+    def indexPlatforms(self, backend: str, platforms):
+        """Registers the (platform id, [names]) pairs a scraper knows"""
+        index = dict()
+        for platformId, names in platforms:
+            for name in names:
+                if name:
+                    index.setdefault(normalizeName(name), str(platformId))
+        with self.lock:
+            self.backendIds[backend] = index
+        logging.debug('%d platform names indexed for %s', len(index), backend)
+
+    def platformId(self, system: str, backend: str) -> str | None:
+        """The platform id of a system for a scraper, None if unknown"""
+        key = self.resolve(system)
+        if key and backend in self.systems[key].get('ids', {}):
+            return str(self.systems[key]['ids'][backend])
+        index = self.backendIds.get(backend, {})
+        names = [system] if not key else [system, key, self.systems[key]['name']] + self.systems[key].get('aliases', [])
+        for name in names:
+            platformId = index.get(normalizeName(name))
+            if platformId:
+                return platformId
+        return None
+
+
+Platforms = PlatformRegistry()
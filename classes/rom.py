@@ -1,12 +1,59 @@
-import binascii
-import hashlib
+import logging
 import os
 import py7zr
 import zipfile
+try:
+	from py7zr.io import Py7zIO, WriterFactory
+except ImportError:
+	# py7zr < 1.0 has no writer factories, 7z members are read in memory
+	Py7zIO = WriterFactory = None
+from classes.discimage import readChdSha1, resolveDataTrack
+from classes.hashing import MultiHasher, hashFile, hashStream
+
+
+class HasherIO(Py7zIO or object):
+	"""py7zr writer that hashes the decompressed data instead of storing it"""
+	def __init__(self, filename: str, crc: bool = True):
+		self.filename = filename
+		self.hasher = MultiHasher(crc)
+
+	def write(self, s) -> int:
+		self.hasher.update(s)
+		return len(s)
+
+	def read(self, size=None) -> bytes:
+		return b''
+
+	def seek(self, offset: int, whence: int = 0) -> int:
+		return 0
+
+	def flush(self):
+		pass
+
+	def size(self) -> int:
+		return self.hasher.size
+
+
+class HasherIOFactory(WriterFactory or object):
+	def __init__(self, crc: bool = True):
+		self.crc = crc
+		self.products = dict()
+
+	def create(self, filename: str) -> Py7zIO:
+		product = HasherIO(filename, self.crc)
+		self.products[filename] = product
+		return product
+
 
 class Rom:
+	# A romlist holds a Rom per game for the whole run, keep them small
+	__slots__ = ('rompathname', 'rompath', 'romfile', 'romname', 'romext', '_crc', '_md5', '_sha1', 'filecrc',
+		'archiveContent', 'hashThroughput', 'hashedBytes', 'hashedFile', '_romsize', 'hashed', 'hashCache')
+	isoExtensions = ('iso', 'cue', 'chd')
+
 	# rom must be a fullpath to an existing rom file
-	def __init__(self, rom: str, crc = '', filecrc = ''):
+	# hashCache is an optional RomHashCache to skip hashing unchanged roms
+	def __init__(self, rom: str, crc = '', filecrc = '', hashCache = None):
 		if not os.path.exists(rom):
 			raise Exception(rom + " doesn't exist")
 		self.rompathname = rom
@@ -14,36 +61,110 @@ class Rom:
 		self.romfile = os.path.basename(rom)
 		self.romname = os.path.splitext(self.romfile)[0]
 		self.romext = os.path.splitext(rom)[1][1:]
-		self.crc = crc
-		self.md5 = None
-		self.sha1 = None
+		# Hashes are computed on first access only, see the crc, md5 and sha1 properties
+		self._crc = crc
+		self._md5 = None
+		self._sha1 = None
 		self.filecrc = filecrc
 		self.archiveContent = []
-		self.isoExtensions = ['iso', 'cue', 'chd']
-		self.getCRC()
-		self.getMD5()
-		self.getSHA1()
+		self.hashThroughput = 0.0 # MB/s of the hashing pass
+		self.hashedBytes = 0
+		self.hashedFile = None # The file actually hashed, may be a disc track
+		self._romsize = None
+		self.hashed = False
+		self.hashCache = hashCache
+		if hashCache:
+			hashCache.load(self)
+
+	def __getstate__(self):
+		# Roms travel between processes, the cache connection can't
+		state = {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}
+		state['hashCache'] = None
+		return state
+
+	def __setstate__(self, state):
+		for k, v in state.items():
+			setattr(self, k, v)
 
 	def __repr__(self):
-		return "Rom('{}', crc = '{}', filecrc = '{}')".format(self.rompathname, self.crc, self.filecrc)
+		return "Rom('{}', crc = '{}', filecrc = '{}')".format(self.rompathname, self._crc, self.filecrc)
 
 	def __str__(self):
-		return "Rom: {}\nSplit into {} / {} . {}\nHashes:\n  - CRC: {}\n  - MD5: {}\n  - SHA1: {}\nFile content:: {}".format(self.rompathname, self.rompath, self.romfile, self.romext, self.crc, self.md5, self.sha1, self.archiveContent)
+		return "Rom: {}\nSplit into {} / {} . {}\nHashes:\n  - CRC: {}\n  - MD5: {}\n  - SHA1: {}\nFile content:: {}".format(self.rompathname, self.rompath, self.romfile, self.romext, self._crc, self._md5, self._sha1, self.archiveContent)
+
+	@property
+	def crc(self) -> str | None:
+		return self.getCRC()
+
+	@crc.setter
+	def crc(self, value):
+		self._crc = value
+
+	@property
+	def md5(self) -> str | None:
+		return self.getMD5()
+
+	@md5.setter
+	def md5(self, value):
+		self._md5 = value
+
+	@property
+	def sha1(self) -> str | None:
+		return self.getSHA1()
+
+	@sha1.setter
+	def sha1(self, value):
+		self._sha1 = value
+
+	def knownHashes(self) -> dict:
+		"""The hashes computed so far, without triggering any computation"""
+		return {'crc': self._crc or None, 'md5': self._md5, 'sha1': self._sha1}
+
+	def identifier(self, name: str) -> str | None:
+		"""Value of a scraper lookup identifier (crc, md5, sha1, romnom or romname)"""
+		if name == 'romnom':
+			return self.romfile
+		if name == 'romname':
+			return self.romname
+		if name in ['crc', 'md5', 'sha1']:
+			return getattr(self, name)
+		if name == 'romtaille':
+			size = self.getRomSize()
+			return str(size) if size is not None else None
+		raise ValueError("Unknown rom identifier {}".format(name))
+
+	def getRomSize(self) -> int | None:
+		"""Size of the rom data: the archive member or the disc data track. None for multi files archives"""
+		if self._romsize is not None:
+			return self._romsize
+		if self.romext == 'zip':
+			with zipfile.ZipFile(self.rompathname) as romzip:
+				members = [f.file_size for f in romzip.infolist() if not f.is_dir()]
+		elif self.romext == '7z':
+			with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
+				members = [f.uncompressed for f in romzip.list() if not f.is_directory]
+		else:
+			members = [os.path.getsize(self.hashedFile or resolveDataTrack(self.rompathname))]
+		if len(members) == 1:
+			self._romsize = members[0]
+		return self._romsize
 
 	def getCRC(self) -> str |None:
-		if self.crc:
-			return self.crc
-		self.listArchive()
+		if self._crc:
+			return self._crc
+		if not self.archiveContent:
+			self.listArchive()
 		if len(self.archiveContent) == 1:
-			self.crc = list(self.archiveContent[0].values())[0].zfill(8)
-		else:
-			self.crc = None
-		return self.crc
+			# Cheap: read from the archive headers, no decompression
+			self._crc = list(self.archiveContent[0].values())[0].zfill(8)
+			self.storeHashes()
+		elif not self.archiveContent and not self.hashed:
+			self.computeHashes()
+		return self._crc
 
 	def fileCRC(self) -> str:
-		buf = open(self.rompathname, 'rb').read()
-		buf = (binascii.crc32(buf) & 0xFFFFFFFF)
-		self.filecrc = "%08X" % buf
+		if not self.filecrc:
+			self.filecrc = hashFile(self.rompathname).hexdigests()['crc'].upper()
 		return self.filecrc
 
 	def listArchiveFromZip(self) -> list:
@@ -55,15 +176,18 @@ class Rom:
 				filesList.append({f.filename: f'{decimalCRC:x}'})
 		return filesList
 
-	def listArchiveFrom7z(self) -> list:
+	def list7zContent(self, romzip) -> list:
 		filesList = []
-		with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
-			zipinfodata = romzip.list()
-			for f in zipinfodata:
-				decimalCRC = zipinfodata[0].crc32
-				filesList.append({f.filename: f'{decimalCRC:x}'})
+		for f in romzip.list():
+			if f.is_directory:
+				continue
+			filesList.append({f.filename: f'{f.crc32:x}'})
 		return filesList
 
+	def listArchiveFrom7z(self) -> list:
+		with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
+			return self.list7zContent(romzip)
+
 	def listArchive(self) -> list | None:
 		if self.romext not in ['7z', 'zip']:
 			return None
@@ -72,55 +196,93 @@ class Rom:
 		if self.romext == '7z':
 			self.archiveContent = self.listArchiveFrom7z()
 
-	def extractFileFromZip(self, archiveFile: str, destinationPath = '/tmp') -> str:
+	def hashMembersFromZip(self) -> dict:
+		# The CRC is already in the zip central directory, no need to compute it
+		hashers = dict()
 		with zipfile.ZipFile(self.rompathname) as romzip:
-			outputFile = romzip.extract(archiveFile, destinationPath)
-			return outputFile
+			for f in romzip.infolist():
+				if f.is_dir():
+					continue
+				with romzip.open(f) as member:
+					hashers[f.filename] = hashStream(member, MultiHasher(crc=False))
+		return hashers
 
-	def extractFileFrom7z(self, archiveFile: str, destinationPath = '/tmp') -> str:
+	def hashMembersFrom7z(self) -> dict:
+		# Solid archives decompress from the start each time they are read, so
+		# list and hash all members with a single open and a single pass
+		if WriterFactory is None:
+			with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
+				self.archiveContent = self.list7zContent(romzip)
+				return {name: hashStream(data, MultiHasher(crc=False)) for name, data in romzip.readall().items()}
+		factory = HasherIOFactory(crc=False)
 		with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
-			romzip.extract(destinationPath, archiveFile)
-			return "{}/{}".format(destinationPath, archiveFile)
+			self.archiveContent = self.list7zContent(romzip)
+			romzip.extract(factory=factory)
+		return {name: product.hasher.finish() for name, product in factory.products.items()}
 
-	def extractRom(self, path='/tmp', fileName=None):
-		extractedFileLocation = None
-		if not fileName:
-			fileName = list(self.archiveContent[0].keys())[0]
+	def hashArchiveMembers(self) -> dict:
+		"""Hashes every archive member from the decompressed streams, nothing is written to disk
+
+		Returns the MultiHasher of each member, the CRCs are left to the archive listing
+		"""
 		if self.romext == 'zip':
-			extractedFileLocation = self.extractFileFromZip(fileName)
+			hashers = self.hashMembersFromZip()
+			if not self.archiveContent:
+				self.listArchive()
+			return hashers
 		if self.romext == '7z':
-			extractedFileLocation = self.extractFileFrom7z(fileName)
-		return extractedFileLocation
+			return self.hashMembersFrom7z()
+		return dict()
 
 	def md5sum(self, filename):
-		return hashlib.md5(open(filename,'rb').read()).hexdigest()
+		return hashFile(filename).hexdigests()['md5']
 
 	def sha1sum(self, filename):
-		return hashlib.sha1(open(filename,'rb').read()).hexdigest()
+		return hashFile(filename).hexdigests()['sha1']
 
-	def getMD5orSHA1(self, hashType) -> str | None:
-		rom = ''
-		if hashType not in ['md5', 'sha1']:
-			return None
-		if len(self.archiveContent) != 1:
-			if hashType == 'md5':
-				return self.md5sum(self.rompathname)
-			elif hashType == 'sha1':
-				return self.sha1sum(self.rompathname)
-		rom = self.extractRom()
-		if hashType == 'md5':
-			romHash = self.md5sum(rom)
-		elif hashType == 'sha1':
-			romHash = self.sha1sum(rom)
-		os.remove(rom)
-		return romHash
+	def computeHashes(self):
+		"""Fills crc, md5 and sha1 with a single chunked read of the rom"""
+		self.hashed = True
+		if self.romext in ['zip', '7z']:
+			if not self.archiveContent:
+				self.listArchive()
+			if len(self.archiveContent) == 1:
+				hasher = list(self.hashArchiveMembers().values())[0]
+			else:
+				# Multi files archives are identified by the archive itself, no need to decompress them
+				hasher = hashFile(self.rompathname)
+		else:
+			# cue/gdi/m3u: hash the data track, that's what databases index
+			self.hashedFile = resolveDataTrack(self.rompathname)
+			if self.hashedFile.lower().endswith('.chd'):
+				# Only the SHA1 is available, and it's in the CHD header
+				self._sha1 = readChdSha1(self.hashedFile)
+				self.storeHashes()
+				return
+			hasher = hashFile(self.hashedFile)
+			if self.hashedFile == self.rompathname:
+				self.filecrc = hasher.hexdigests()['crc'].upper()
+		romHashes = hasher.hexdigests()
+		# Multi files archives have no meaningful rom CRC, keep it empty
+		if not self._crc and len(self.archiveContent) <= 1:
+			self._crc = romHashes['crc'] or list(self.archiveContent[0].values())[0].zfill(8)
+		self._md5 = romHashes['md5']
+		self._sha1 = romHashes['sha1']
+		self.hashThroughput = hasher.throughput()
+		self.hashedBytes = hasher.size
+		logging.debug('%s: hashed %.1f MB in %.2fs (%.1f MB/s)', self.romfile, hasher.size / (1024 * 1024), hasher.elapsed, self.hashThroughput)
+		self.storeHashes()
+
+	def storeHashes(self):
+		if self.hashCache:
+			self.hashCache.store(self)
 
 	def getMD5(self):
-		if not self.md5:
-			self.md5 = self.getMD5orSHA1('md5')
-		return self.md5
+		if not self._md5 and not self.hashed:
+			self.computeHashes()
+		return self._md5
 
 	def getSHA1(self):
-		if not self.sha1:
-			self.sha1 = self.getMD5orSHA1('sha1')
-		return self.sha1
\ No newline at end of file
+		if not self._sha1 and not self.hashed:
+			self.computeHashes()
+		return self._sha1
@@ -0,0 +1,70 @@
+"""Persistent rom hashes index, so unchanged roms are never hashed twice"""
+
+import json
+import logging
+import os
+from classes.cache import SqliteCache
+from classes.discimage import DescriptorExtensions, resolveDataTrack
+
+ROMCACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roms (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime INTEGER,
+    inode INTEGER,
+    crc TEXT,
+    md5 TEXT,
+    sha1 TEXT,
+    archive TEXT,
+    track TEXT
+);
+"""
+
+
+class RomHashCache(SqliteCache):
+    """Rom hashes keyed on the rom path, only valid while size, mtime and inode don't change"""
+    def __init__(self, fileName: str = 'romhashes.db'):
+        super().__init__(fileName, ROMCACHE_SCHEMA)
+        # Indexes created before the track column. Their rows no longer match and get hashed again
+        if 'track' not in [row[1] for row in self.execute('PRAGMA table_info(roms)')]:
+            self.execute('ALTER TABLE roms ADD COLUMN track TEXT')
+        self.hits = 0
+        self.misses = 0
+
+    def statSignature(self, path: str) -> tuple:
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def trackSignature(self, path: str) -> str | None:
+        """cue/gdi/m3u roms are hashed on their data track, which can change while they don't"""
+        if os.path.splitext(path)[1][1:].lower() not in DescriptorExtensions:
+            return None
+        track = resolveDataTrack(path)
+        st = os.stat(track)
+        return json.dumps([os.path.abspath(track), st.st_size, st.st_mtime_ns])
+
+    def load(self, rom) -> bool:
+        """Fills the rom hashes from the index. Returns False if the rom is unknown or has changed"""
+        rows = self.execute('SELECT size, mtime, inode, crc, md5, sha1, archive, track FROM roms WHERE path = ?',
+            (os.path.abspath(rom.rompathname),))
+        if not rows or tuple(rows[0][0:3]) != self.statSignature(rom.rompathname) \
+                or rows[0][7] != self.trackSignature(rom.rompathname):
+            self.misses += 1
+            return False
+        _, _, _, rom.crc, rom.md5, rom.sha1, archive, _ = rows[0]
+        # Hashes are lazy, some of them may not have been computed yet
+        if archive:
+            archive = json.loads(archive)
+            # Rows written with the member hashes hold them next to the content
+            rom.archiveContent = archive['content'] if isinstance(archive, dict) else archive
+        self.hits += 1
+        logging.debug('%s: hashes loaded from cache', rom.romfile)
+        return True
+
+    def store(self, rom):
+        size, mtime, inode = self.statSignature(rom.rompathname)
+        hashes = rom.knownHashes()
+        self.execute('INSERT OR REPLACE INTO roms (path, size, mtime, inode, crc, md5, sha1, archive, track) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (os.path.abspath(rom.rompathname), size, mtime, inode, hashes['crc'], hashes['md5'], hashes['sha1'],
+            json.dumps(rom.archiveContent) if rom.archiveContent else None,
+            self.trackSignature(rom.rompathname)))
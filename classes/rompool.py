@@ -0,0 +1,86 @@
+"""Parallel rom hashing stage, feeding the scraping stage as soon as roms are ready"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from classes.rom import Rom
+
+# Identifiers that need to read the rom content
+HashIdentifiers = ['crc', 'md5', 'sha1']
+
+
+def hashRom(rompathname: str, identifiers: list) -> Rom:
+    """Runs in a worker process: computes the first hash the scraper will be able to use"""
+    rom = Rom(rompathname)
+    for hashType in identifiers:
+        # Multi files archives have no CRC, the next identifier will do
+        if hashType in HashIdentifiers and rom.identifier(hashType):
+            break
+    return rom
+
+
+def hasNeededHash(rom: Rom, hashTypes: list) -> bool:
+    knownHashes = rom.knownHashes()
+    return any(knownHashes[h] for h in hashTypes)
+
+
+def contentKey(rom: Rom, identifiers: list) -> tuple | None:
+    """What identifies the rom content for the scraper, so identical dumps are looked up once
+
+    None when the scraper doesn't use hashes. A CRC alone is too weak, the size goes with it.
+    """
+    knownHashes = rom.knownHashes()
+    for h in identifiers:
+        if h in HashIdentifiers and knownHashes[h]:
+            if h == 'crc':
+                return (h, knownHashes[h].lower(), rom.getRomSize())
+            return (h, knownHashes[h].lower())
+    return None
+
+
+def hashRoms(files: list, identifiers: list, workers: int = 0, hashCache = None):
+    """Yields Rom objects for files, hashing them in a process pool
+
+    Roms are yielded as soon as they are ready, not in the files order. Roms known
+    by hashCache, or for which the scraper needs no hash, are yielded first.
+    """
+    hashTypes = [i for i in identifiers if i in HashIdentifiers]
+    toHash = list()
+    for f in files:
+        rom = Rom(f, hashCache=hashCache)
+        if not hashTypes or hasNeededHash(rom, hashTypes):
+            yield rom
+        else:
+            toHash.append(f)
+    if not toHash:
+        return
+
+    workers = workers or os.cpu_count() or 1
+    logging.info('Hashing %d roms with %d workers', len(toHash), workers)
+    startTime = time.monotonic()
+    hashedBytes = 0
+    if workers == 1:
+        pending = ((f, lambda f=f: hashRom(f, identifiers)) for f in toHash)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {executor.submit(hashRom, f, identifiers): f for f in toHash}
+        pending = ((futures[future], future.result) for future in as_completed(futures))
+    try:
+        for f, getRom in pending:
+            try:
+                rom = getRom()
+            except Exception as e:
+                # A broken archive must not stop the whole scan
+                logging.error("Couldn't hash %s: %s", f, e)
+                continue
+            hashedBytes += rom.hashedBytes
+            rom.hashCache = hashCache
+            rom.storeHashes()
+            yield rom
+    finally:
+        if workers > 1:
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.monotonic() - startTime
+    logging.info('Hashed %d roms, %.1f MB in %.1fs (%.1f MB/s)', len(toHash), hashedBytes / (1024 * 1024),
+        elapsed, hashedBytes / (1024 * 1024) / elapsed if elapsed else 0)
@@ -125,10 +125,11 @@ class AttractMode(FrontEnd):
         return file_list
 
     def make_romlist_line_from_rom_and_gameinfo(self, emuname: str, rom:Rom, rom_gameinfo:GameInfo):
-        return '%s;%s;%s;;%s;%s;%s;%s;%s;;;;;;;;;;;;\n' % (
+        return '%s;%s;%s;%s;%s;%s;%s;%s;%s;;;;;;;;;;;;\n' % (
                     rom.romname,
                     rom_gameinfo['title'],
                     emuname,
+                    rom_gameinfo['cloneof'] or '',
                     rom_gameinfo['date'],
                     rom_gameinfo['developer'],
                     ','.join(rom_gameinfo['category']) if rom_gameinfo['category'] else '',
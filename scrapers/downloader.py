@@ -0,0 +1,87 @@
+"""Media download stage, running next to the metadata lookups"""
+
+import logging
+import os
+import queue
+import threading
+from classes.gameinfo import Media
+from classes.mediastore import linkFile
+
+
+class MediaDownloader:
+    """A pool of threads downloading (Media, destination) jobs through a scraper
+
+    The queue is bounded: when downloads can't keep up, submit() blocks instead
+    of piling up jobs in memory. A media URL is downloaded once, the other
+    destinations wanting it (duplicate roms, clones) get a link to the first file.
+    """
+    def __init__(self, scraper, workers: int = 2, queueSize: int = 0):
+        self.scraper = scraper
+        self.jobs = queue.Queue(maxsize=queueSize or workers * 4)
+        self.downloaded = 0
+        self.failed = 0
+        self.linked = 0
+        self.lock = threading.Lock()
+        self.fetched = dict() # url -> downloaded file
+        self.urlLocks = dict()
+        self.threads = [threading.Thread(target=self.worker, name='downloader-{}'.format(i), daemon=True)
+            for i in range(max(workers, 1))]
+        for t in self.threads:
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, media: Media, destination: str, force_mkdir: bool = False, overwrite: bool = False, verify: bool = False):
+        self.jobs.put((media, destination, force_mkdir, overwrite, verify))
+
+    def urlLock(self, url: str) -> threading.Lock:
+        with self.lock:
+            if url not in self.urlLocks:
+                self.urlLocks[url] = threading.Lock()
+            return self.urlLocks[url]
+
+    def download(self, media: Media, destination: str, force_mkdir: bool, overwrite: bool, verify: bool):
+        with self.urlLock(media.url):
+            source = self.fetched.get(media.url)
+            if source and source != destination and os.path.exists(source):
+                if not self.scraper.needsDownload(destination, overwrite, media.hashes, verify):
+                    return
+                if force_mkdir:
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                logging.debug('%s already downloaded to %s, linking it', media.url, source)
+                linkFile(source, destination)
+                with self.lock:
+                    self.linked += 1
+                return
+            self.scraper.downloadGameAsset(media, destination, force_mkdir, overwrite, verify)
+            if os.path.exists(destination):
+                self.fetched[media.url] = destination
+
+    def worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            try:
+                self.download(*job)
+                with self.lock:
+                    self.downloaded += 1
+            except Exception as e:
+                logging.error("Couldn't download %s: %s", job[1], e)
+                with self.lock:
+                    self.failed += 1
+            finally:
+                self.jobs.task_done()
+
+    def close(self):
+        """Waits for the queued downloads to finish and stops the workers"""
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        logging.info('Media downloads: %d done (%d linked to an identical media), %d failed', self.downloaded, self.linked, self.failed)
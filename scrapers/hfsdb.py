@@ -3,9 +3,9 @@
 import html
 import json
 import logging
-import requests
 from scrapers.scraper import Scraper
-from classes.gameinfo import GameInfo, Asset, Media, Regions
+from classes.gameinfo import GameInfo, Asset, Media, Regions, internString
+from classes.platforms import Platforms
 
 HFSMedia = ['screenshot', 'video', 'cover2d', 'cover3d', 'cover2d', 'None',
     'cover2d', 'logo', 'screenshot', 'wheel']
@@ -16,10 +16,12 @@ HFSRegions = {'PAL': 'eu', 'US': 'us', 'JPN': 'jp', 'WORLD': 'wor'}
 class HFSDB(Scraper):
     """Child class of Scraper the the HFS scraping website
     """
+    romIdentifiers = ['md5']
+    arcadeRomIdentifiers = ['romname']
+
     def __init__(self, user='', password=''):
         super().__init__(name='HFSDB', user = user, password = password
             , baseUrl = 'https://db.hfsplay.fr/api/v1')
-        self.session = requests.session()
         # self.dburl = "https://db.hfsplay.fr/"
         self.appstate = {'token': None, 'username': user}
         self.login()
@@ -44,11 +46,14 @@ class HFSDB(Scraper):
             # logging.debug(nextUrlParams)
             ret = json.loads(self.download('systems', nextUrlParams)['content'])
             # print(ret)
-            tmpcache.append(html.unescape(ret['results']))
+            tmpcache.extend(html.unescape(ret['results']))
             # logging.debug(ret['next'])
         self.platformCache = tmpcache
         self.savePlatformsCache()
 
+    def platformEntries(self) -> list:
+        return [(p['id'], [p.get('name'), p.get('slug')]) for p in self.platformCache if 'id' in p]
+
     def login(self):
         if self.appstate['token']:
             return self.appstate
@@ -64,13 +69,24 @@ class HFSDB(Scraper):
     def queryGameInfo(self, rom, system = None):
         # Query by name on arcade systems
         jsData = []
-        if not system in ['mame', 'arcade', 'mame-libretro', 'mame4all', 'fba']:
-            ret = self.download('games', {'medias__md5': rom.md5})
+        req_value = rom.identifier(self.identifiersFor(system)[0])
+        if not req_value:
+            logging.warning('%s: no identifier available for HFSDB', rom.romfile)
+            return jsData
+        if not Platforms.isArcade(system):
+            params = {'medias__md5': req_value}
         else:
-            ret = self.download('games', {'medias__description': rom.romname})
+            params = {'medias__description': req_value}
+        systemId = self.platformId(system)
+        if systemId:
+            params['system'] = systemId
+        ret = self.cachedDownload('games', params, rom.romfile)
         if ret and ret['status_code'] == 200:
             logging.debug('%s: URL returned status code %s', rom.romfile, str(ret['status_code']))
             jsData = json.loads(ret['content'])
+            # HFSDB answers unknown games with an empty result
+            if jsData.get('count') == 0:
+                self.recordMiss('games', params, rom.romfile)
         # elif ret and ret['status_code'] == 404:
         #     logging.debug(' ***** Got 404, retrying *****')
         #     return self.queryGameInfo(rom, system)
@@ -119,9 +135,9 @@ class HFSDB(Scraper):
                 gameMedia.type = self.getAssetType(i['type'], i['metadata'])
                 gameMedia.hashes = {'crc32': i['crc32'], 'md5': i['md5'], 'sha1': i['sha1']}
                 gameMedia.url = i['file']
-                gameMedia.extension = i['extension']
-                gameMedia.region = HFSRegions[i['region']] if i['region'] in HFSRegions else i['region']
-                gameMedia.scraperMediaType = i['type']
+                gameMedia.extension = internString(i['extension'])
+                gameMedia.region = HFSRegions[i['region']] if i['region'] in HFSRegions else internString(i['region'])
+                gameMedia.scraperMediaType = internString(i['type'])
                 gameMediaList.append(gameMedia)
         return gameMediaList
 
@@ -0,0 +1,74 @@
+"""Offline scraper, reading arcade metadata from a local DAT index"""
+
+import logging
+from scrapers.scraper import Scraper
+from classes.datindex import DatIndex
+from classes.gameinfo import GameInfo
+
+
+class OfflineDB(Scraper):
+    """Child class of Scraper answering from the DATs imported with DatIndex.importDat()
+
+    Games are found by romset name, so roms are never hashed. Medias can come
+    from an online mediaScraper, only queried for them.
+    """
+    romIdentifiers = ['romname']
+    arcadeRomIdentifiers = ['romname']
+
+    def __init__(self, datIndex: DatIndex | None = None, mediaScraper: Scraper | None = None):
+        super().__init__(name='Offline')
+        self.datIndex = datIndex if datIndex else DatIndex()
+        self.mediaScraper = mediaScraper
+        if not self.datIndex.count():
+            logging.warning('The offline index is empty, import a MAME -listxml or a DAT with --import-dat')
+
+    def maxThreads(self) -> int:
+        if self.mediaScraper:
+            return self.mediaScraper.maxThreads()
+        return 1
+
+    def cacheStats(self) -> str:
+        # The online requests are the media scraper ones
+        if self.mediaScraper:
+            return self.mediaScraper.cacheStats()
+        return super().cacheStats()
+
+    def suppressedRoms(self) -> list:
+        if self.mediaScraper:
+            return self.mediaScraper.suppressedRoms()
+        return super().suppressedRoms()
+
+    def downloadGameAsset(self, media, destination: str, force_mkdir: bool=False, overwrite: bool=False, verify: bool=False):
+        if self.mediaScraper:
+            return self.mediaScraper.downloadGameAsset(media, destination, force_mkdir, overwrite, verify)
+        return super().downloadGameAsset(media, destination, force_mkdir, overwrite, verify)
+
+    def getPlatforms(self):
+        # Nothing to download, the DATs are per system already
+        self.platformCache = None
+
+    def identifiersFor(self, system = None) -> list:
+        identifiers = list(self.romIdentifiers)
+        if self.mediaScraper:
+            identifiers.extend(i for i in self.mediaScraper.identifiersFor(system) if i not in identifiers)
+        return identifiers
+
+    def getGameInfo(self, rom, system = None) -> GameInfo | None:
+        game = self.datIndex.lookup(rom.romname)
+        if not game:
+            logging.warning('%s is not in the offline index', rom.romname)
+            return None
+        myGameInfo = GameInfo()
+        myGameInfo.title = {'wor': game['description']}
+        if game['year']:
+            myGameInfo.date = {'wor': game['year']}
+        myGameInfo.developer = game['manufacturer']
+        myGameInfo.cloneof = game['cloneof']
+        if game['rotate'] is not None:
+            myGameInfo.rotation = game['rotate']
+        myGameInfo.players = game['players']
+        if self.mediaScraper:
+            mediaGameInfo = self.mediaScraper.getGameInfo(rom, system)
+            if mediaGameInfo:
+                myGameInfo.medias = mediaGameInfo.medias
+        return myGameInfo
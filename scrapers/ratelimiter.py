@@ -0,0 +1,97 @@
+"""Token bucket shared by all the workers querying the same backend"""
+
+import email.utils
+import logging
+import threading
+import time
+
+# Requests per second allowed after a server backoff when there is no budget,
+# until a request succeeds again. Waiting workers must not all resume at once
+DefaultRecoveryRate = 2.0
+
+
+class RateLimiter:
+    """Allows requestsPerSecond requests on average, and pauses everybody when the server asks to
+
+    requestsPerSecond = 0 means no budget: only the server backoff hints apply, and
+    after a backoff workers resume at recoveryRate until a request succeeds.
+    """
+    def __init__(self, requestsPerSecond: float = 0, burst: int = 1, recoveryRate: float = DefaultRecoveryRate):
+        self.requestsPerSecond = requestsPerSecond
+        self.recoveryRate = recoveryRate
+        self.recovering = False
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.lastRefill = time.monotonic()
+        self.blockedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def setRate(self, requestsPerSecond: float):
+        with self.lock:
+            self.requestsPerSecond = requestsPerSecond
+
+    def acquire(self):
+        """Blocks until the caller is allowed to send a request"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.blockedUntil - now
+                if wait <= 0:
+                    rate = self.requestsPerSecond or (self.recoveryRate if self.recovering else 0)
+                    if not rate:
+                        return
+                    self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * rate)
+                    self.lastRefill = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / rate
+            time.sleep(wait)
+
+    def backoff(self, seconds: float):
+        """The server wants a pause: every worker waits, then restarts with an empty bucket"""
+        with self.lock:
+            now = time.monotonic()
+            self.blockedUntil = max(self.blockedUntil, now + seconds)
+            # Empty bucket, so workers resume one by one at the allowed rate
+            # instead of all hitting the server when the pause is over
+            self.tokens = 0.0
+            self.lastRefill = self.blockedUntil
+            if not self.requestsPerSecond:
+                # No budget to pace the restart: one worker first, then the others
+                # at recoveryRate until the server answers normally again
+                self.recovering = True
+                self.tokens = 1.0
+
+    def success(self):
+        """A request went through, the server is fine with the normal pace again"""
+        if self.recovering:
+            with self.lock:
+                self.recovering = False
+
+
+def retryDelay(headers) -> float:
+    """Seconds to wait according to Retry-After or X-Ratelimit-Retryafter, 0 if none"""
+    if 'Retry-After' in headers:
+        value = headers['Retry-After'].strip()
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        # Retry-After can also be a HTTP date
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            logging.debug('Unreadable Retry-After header: %s', value)
+            return 0.0
+    if 'X-Ratelimit-Retryafter' in headers:
+        value = headers['X-Ratelimit-Retryafter'].strip()
+        try:
+            if value.endswith('ms'):
+                return float(value[:-2]) / 1000
+            if value.endswith('s'):
+                return float(value[:-1])
+            return float(value)
+        except ValueError:
+            logging.debug('Unreadable X-Ratelimit-Retryafter header: %s', value)
+    return 0.0
@@ -0,0 +1,74 @@
+"""On-disk cache of the scrapers metadata answers"""
+
+import json
+import time
+from classes.cache import SqliteCache
+
+RESPONSECACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    backend TEXT,
+    endpoint TEXT,
+    params TEXT,
+    status INTEGER,
+    content BLOB,
+    created REAL,
+    PRIMARY KEY (backend, endpoint, params)
+);
+CREATE TABLE IF NOT EXISTS misses (
+    backend TEXT,
+    endpoint TEXT,
+    params TEXT,
+    romfile TEXT,
+    expires REAL,
+    PRIMARY KEY (backend, endpoint, params)
+);
+"""
+
+# Params which values are case insensitive
+HashParams = ['crc', 'md5', 'sha1', 'medias__md5']
+
+
+def normalizeParams(params: dict) -> str:
+    normalized = dict()
+    for k, v in params.items():
+        v = str(v)
+        normalized[k] = v.lower() if k in HashParams else v
+    return json.dumps(normalized, sort_keys=True)
+
+
+class ResponseCache(SqliteCache):
+    """Answers keyed on backend, endpoint and normalized params, valid for ttl seconds"""
+    def __init__(self, ttl: float, fileName: str = 'responses.db'):
+        super().__init__(fileName, RESPONSECACHE_SCHEMA)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, backend: str, endpoint: str, params: dict) -> dict | None:
+        rows = self.execute('SELECT status, content, created FROM responses WHERE backend = ? AND endpoint = ? AND params = ?',
+            (backend, endpoint, normalizeParams(params)))
+        with self.lock:
+            if not rows or time.time() - rows[0][2] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {'status_code': rows[0][0], 'content': rows[0][1]}
+
+    def put(self, backend: str, endpoint: str, params: dict, response: dict):
+        self.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+            (backend, endpoint, normalizeParams(params), response['status_code'], response['content'], time.time()))
+
+    def isMiss(self, backend: str, endpoint: str, params: dict) -> bool:
+        """True if the backend recently didn't know anything for that query"""
+        rows = self.execute('SELECT expires FROM misses WHERE backend = ? AND endpoint = ? AND params = ?',
+            (backend, endpoint, normalizeParams(params)))
+        return bool(rows) and rows[0][0] > time.time()
+
+    def putMiss(self, backend: str, endpoint: str, params: dict, romfile: str, ttl: float):
+        self.execute('INSERT OR REPLACE INTO misses VALUES (?, ?, ?, ?, ?)',
+            (backend, endpoint, normalizeParams(params), romfile, time.time() + ttl))
+
+    def purge(self):
+        """Drops the expired answers and misses"""
+        self.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+        self.execute('DELETE FROM misses WHERE expires < ?', (time.time(),))
@@ -1,15 +1,32 @@
 import json
 import logging
-import math
 import os
 import requests
-import sys
-import time
+from requests.adapters import HTTPAdapter
+import threading
+from classes.cache import cacheFolder
+from classes.hashing import CHUNK_SIZE, fileMatchesHashes
+from classes.platforms import Platforms
 from classes.gameinfo import GameInfo, Asset, Media
+from scrapers.ratelimiter import RateLimiter, retryDelay
+from scrapers.responsecache import ResponseCache
+
+# HTTP connections kept alive per host, should match the number of workers
+DefaultPoolSize = 10
+
+# How long metadata answers are kept, in seconds
+DefaultResponseCacheTtl = 30 * 24 * 3600
+# How long a lookup that found nothing is not tried again, in seconds
+DefaultMissTtl = 7 * 24 * 3600
 
 
 class Scraper(object):
-    def __init__(self, name = '', baseUrl = '', baseUrlParams = '', apiKey = '', devUser = '', devPassword = '', user = '', password = ''):
+    # Rom identifiers the scraper can query, in lookup order (see Rom.identifier()).
+    # Rom hashes are lazy, so the ones that are never used are never computed
+    romIdentifiers = ['crc', 'md5', 'sha1', 'romnom']
+    arcadeRomIdentifiers = ['romnom']
+
+    def __init__(self, name = '', baseUrl = '', baseUrlParams = '', apiKey = '', devUser = '', devPassword = '', user = '', password = '', poolSize = DefaultPoolSize, requestsPerSecond = 0, responseCacheTtl = DefaultResponseCacheTtl):
         self.name = name
         self.baseUrl = baseUrl
         self.baseUrlParams = baseUrlParams
@@ -21,26 +38,87 @@ class Scraper(object):
         self.cacheDir = self.cacheFolder()
         self.platformCacheFile= self.cacheDir + '/' + self.name + '_platforms.cache'
         self.platformCache = self.loadPlatformsCache()
-        self.session = None # If we need to handle a HTTP session
+        self.platformLock = threading.Lock()
+        self.platformsIndexed = False
+        # A single pooled keep-alive session for metadata and media downloads,
+        # shared by all workers
+        self.timeout = 30
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.setPoolSize(poolSize)
+        # Shared by all workers, so a server backoff pauses all of them
+        self.rateLimiter = RateLimiter(requestsPerSecond)
+        self.maxRetries = 1
+        self.maxResumes = 3 # Range requests tried when a media transfer breaks
+        self.responseCache = None
+        self.setResponseCacheTtl(responseCacheTtl)
+        self.mediaStore = None # A MediaStore to share identical medias between games and emulators
+        self.missTtl = DefaultMissTtl
+        self.ignoreMisses = False # Set to retry lookups known to find nothing
+        self.suppressedLookups = list() # (romfile, endpoint, params) skipped as known misses
 
     # def __del__(self):
         # self.savePlatformsCache()
 
     def cacheFolder(self) -> str:
-        cacheDir = ''
-        if sys.platform == 'win32':
-            cacheDir = os.path.expanduser('%LOCALAPPDATA%')
-        # Common Linux/MacOS
+        return cacheFolder()
+
+    def setPoolSize(self, poolSize: int):
+        """Resize the HTTP connections pool, typically to the number of workers using the scraper"""
+        # pool_block makes extra workers wait for a free connection instead of
+        # opening throwaway ones
+        adapter = HTTPAdapter(pool_maxsize=max(poolSize, 1), pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.poolSize = poolSize
+
+    def setResponseCacheTtl(self, ttl: float):
+        """How long metadata answers are reused, in seconds. 0 disables the cache"""
+        if not ttl:
+            self.responseCache = None
+        elif self.responseCache:
+            self.responseCache.ttl = ttl
         else:
-            cacheDir = os.path.expanduser('~')
-        cacheDir += '/.cache/altscraper'
-        if not os.path.exists(cacheDir):
-            logging.debug('Creating cache folder ' + cacheDir)
-            os.mkdir(cacheDir)
-        return cacheDir
+            self.responseCache = ResponseCache(ttl)
+            self.responseCache.purge()
 
-    def download(self, endpoint: str, params: dict[str, str] = {}) -> dict:
-        """Basic downloading using endpoints and parameters"""
+    def cachedDownload(self, endpoint: str, params: dict[str, str] = {}, romfile: str = '') -> dict:
+        """Same as download(), but successful answers are served from the on-disk cache
+
+        Queries that recently returned 404 are not sent again, unless ignoreMisses is set
+        """
+        if not self.responseCache:
+            return self.download(endpoint, params)
+        if not self.ignoreMisses and self.responseCache.isMiss(self.name, endpoint, params):
+            logging.debug('%s %s is a known miss, skipping', endpoint, params)
+            self.suppressedLookups.append((romfile, endpoint, params))
+            return {'status_code': 404, 'content': b''}
+        ret = self.responseCache.get(self.name, endpoint, params)
+        if ret:
+            logging.debug('%s %s answered from cache', endpoint, params)
+            return ret
+        ret = self.download(endpoint, params)
+        if ret and ret['status_code'] == 200:
+            self.responseCache.put(self.name, endpoint, params, ret)
+        elif ret and ret['status_code'] == 404:
+            self.recordMiss(endpoint, params, romfile)
+        return ret
+
+    def recordMiss(self, endpoint: str, params: dict[str, str], romfile: str = ''):
+        """Remember the backend has nothing for that query, for missTtl seconds"""
+        if self.responseCache and self.missTtl:
+            self.responseCache.putMiss(self.name, endpoint, params, romfile, self.missTtl)
+
+    def suppressedRoms(self) -> list:
+        """Roms for which at least a lookup was skipped as a known miss"""
+        return sorted(set(romfile for romfile, _, _ in self.suppressedLookups))
+
+    def cacheStats(self) -> str:
+        if not self.responseCache:
+            return 'Metadata cache disabled'
+        return 'Metadata cache: {} hits, {} misses'.format(self.responseCache.hits, self.responseCache.misses)
+
+    def buildUrl(self, endpoint: str, params: dict[str, str] = {}) -> str:
         # First build up the url with trha parameters
         isFirstParam = True
         targetUrl = self.baseUrl + '/' + endpoint
@@ -55,73 +133,248 @@ class Scraper(object):
                 else:
                     targetUrl += '&{}={}'.format(k, v)
         # logging.debug(targetUrl)
-        return self.downloadFromUrl(targetUrl)
+        return targetUrl
 
-    def downloadFromUrl(self, targetUrl: str, allow_retry: bool = True) -> dict:
-        """Low level downloading using an URL"""
-        pause_time = 0
-        # try:
-        if pause_time == 0:
-            if self.session:
-                r = self.session.get(targetUrl)
-            else:
-                r = requests.get(targetUrl)
+    def download(self, endpoint: str, params: dict[str, str] = {}) -> dict:
+        """Basic downloading using endpoints and parameters"""
+        return self.downloadFromUrl(self.buildUrl(endpoint, params))
+
+    def request(self, targetUrl: str, allow_retry: bool = True, stream: bool = False, headers: dict | None = None) -> requests.Response:
+        """Rate limited GET, retried when the server asks us to slow down"""
+        retries = self.maxRetries if allow_retry else 0
+        for attempt in range(retries + 1):
+            self.rateLimiter.acquire()
+            r = self.session.get(targetUrl, timeout=self.timeout, stream=stream, headers=headers)
             # logging.debug(r.headers)
-            if 'Retry-After' in r.headers:
-                pause_time = float(r.headers["Retry-After"])
-            elif 'X-Ratelimit-Retryafter' in r.headers:
-                value = r.headers["X-Ratelimit-Retryafter"]
-                if value[-2:] == 'ms':
-                    pause_time = 1
-                else:
-                    pause_time = math.ceil(float(value[:-1]))
+            pause_time = retryDelay(r.headers)
+            if not pause_time and r.status_code == 429:
+                pause_time = 1
             if pause_time > 0:
-                # pause_time += 1
-                logging.warn('The server wants us to go easy on requests. Pausing for %d seconds not to spam the server', pause_time)
-                time.sleep(pause_time)
-                if allow_retry:
+                logging.warning('The server wants us to go easy on requests. Pausing all workers for %.3f seconds not to spam the server', pause_time)
+                self.rateLimiter.backoff(pause_time)
+                if r.status_code in [429, 503] and attempt < retries:
                     logging.info('Retrying the query')
-                    return self.downloadFromUrl(targetUrl, False)
-            return {'status_code': r.status_code, 'content': r.content}
-        # except:
-            logging.error("An error ocurred when downloading from an URL")
-        return {}
-
-    def downloadToFileFromUrl(self, url: str, destinationFile: str, force_mkdir: bool=False, force_download=False):
-        """Download to a file using an URL"""
-        logging.debug('Trying to download to "%s"' % destinationFile)
-        if os.path.exists(destinationFile) and not force_download:
+                    r.close()
+                    continue
+            elif r.status_code not in [429, 503]:
+                self.rateLimiter.success()
+            return r
+
+    def downloadFromUrl(self, targetUrl: str, allow_retry: bool = True) -> dict:
+        """Low level downloading using an URL"""
+        try:
+            r = self.request(targetUrl, allow_retry)
+        except requests.RequestException as e:
+            logging.error("An error ocurred when downloading from an URL: %s", e)
+            return {}
+        return {'status_code': r.status_code, 'content': r.content}
+
+    def needsDownload(self, destinationFile: str, force_download: bool = False, expectedHashes: dict | None = None, verify_existing: bool = False) -> bool:
+        """Tells if destinationFile has to be (down)loaded, logs why not"""
+        if not os.path.exists(destinationFile):
+            return True
+        if verify_existing:
+            upToDate = fileMatchesHashes(destinationFile, expectedHashes)
+            if upToDate:
+                logging.info('%s is up to date, skipping download', destinationFile)
+                return False
+            if upToDate is None and not force_download:
+                logging.info('%s already exists and has no hash to compare with, skipping download', destinationFile)
+                return False
+            return True
+        if not force_download:
             logging.info('%s already exists, skipping download', destinationFile)
+            return False
+        return True
+
+    def downloadToFileFromUrl(self, url: str, destinationFile: str, force_mkdir: bool=False, force_download=False, expectedHashes: dict | None = None, verify_existing: bool=False, strict_hashes: bool=False) -> bool | None:
+        """Download to a file using an URL
+
+        The data is streamed by chunks to destinationFile.part, then renamed: memory
+        use doesn't depend on the file size and an interrupted download never
+        leaves a truncated file at the final path.
+        A broken transfer keeps the .part file and continues with a HTTP Range
+        request, now or on the next run. The ETag or Last-Modified of the remote
+        file is kept in .part.meta and sent as If-Range, so that a changed file
+        is downloaded from the start. A .part left by a previous run without such
+        a validator is only resumed when expectedHashes can check it.
+        A resumed file is checked against expectedHashes ({'crc32', 'md5', 'sha1'})
+        and fully downloaded again if it doesn't match.
+        With verify_existing, an existing destinationFile is only replaced if it
+        doesn't match expectedHashes.
+        With strict_hashes, a download that doesn't match expectedHashes is dropped
+        and False is returned, instead of only logging a warning.
+        """
+        logging.debug('Trying to download to "%s"' % destinationFile)
+        if not self.needsDownload(destinationFile, force_download, expectedHashes, verify_existing):
             return
-        data = self.downloadFromUrl(url)
-        if not data or data['status_code'] != 200:
-            return None
         if force_mkdir:
             dest_path = os.path.dirname(destinationFile)
             if not os.path.exists(dest_path):
                 logging.info("%s doesn't exist, creating it", dest_path)
-                os.makedirs(dest_path)
-        with open(destinationFile,'wb') as f:
-            logging.debug("Writing %s", destinationFile)
-            f.write(data['content'])
-        
+                os.makedirs(dest_path, exist_ok=True)
+        partFile = destinationFile + '.part'
+        validator = self.partValidator(partFile, url)
+        if os.path.exists(partFile) and validator is None and not expectedHashes:
+            # Nothing tells the remote file is still the one it was started from
+            logging.info('Discarding %s, it may come from another version of %s', partFile, url)
+            self.removePartFile(partFile)
+        resumed = False
+        for attempt in range(self.maxResumes + 1):
+            offset = os.path.getsize(partFile) if os.path.exists(partFile) else 0
+            headers = None
+            if offset:
+                headers = {'Range': 'bytes=%d-' % offset}
+                if validator:
+                    headers['If-Range'] = validator
+            try:
+                with self.request(url, stream=True, headers=headers) as r:
+                    if r.status_code == 416 and offset:
+                        if validator or expectedHashes:
+                            # Nothing left to download, the hashes check will tell
+                            resumed = True
+                            break
+                        logging.info("Can't tell if %s is complete, downloading it again", destinationFile)
+                        self.removePartFile(partFile)
+                        continue
+                    if r.status_code == 206 and r.headers.get('Content-Range', '').startswith('bytes %d-' % offset):
+                        logging.info('Resuming %s from byte %d', destinationFile, offset)
+                        mode = 'ab'
+                        resumed = True
+                    elif r.status_code == 200:
+                        # No range support or the remote file changed, start over
+                        mode = 'wb'
+                        resumed = False
+                        validator = self.storePartValidator(partFile, url, r.headers)
+                    else:
+                        logging.debug('%s: HTTP status %d', url, r.status_code)
+                        return None
+                    with open(partFile, mode) as f:
+                        logging.debug("Writing %s", destinationFile)
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                break
+            except requests.RequestException as e:
+                logging.warning("Download of %s interrupted: %s", destinationFile, e)
+            except OSError as e:
+                logging.error("Couldn't write %s: %s", destinationFile, e)
+                self.removePartFile(partFile)
+                return None
+        else:
+            logging.error("Couldn't download %s, %s is kept to resume later", destinationFile, partFile)
+            return None
+        if fileMatchesHashes(partFile, expectedHashes) is False:
+            if resumed:
+                logging.warning("Resumed %s doesn't match its hashes, downloading it again", destinationFile)
+                self.removePartFile(partFile)
+                return self.downloadToFileFromUrl(url, destinationFile, force_mkdir, True, expectedHashes, strict_hashes=strict_hashes)
+            logging.warning("%s doesn't match the hashes given by %s", destinationFile, self.name)
+            if strict_hashes:
+                self.removePartFile(partFile)
+                return False
+        os.replace(partFile, destinationFile)
+        self.removePartFile(partFile)
+        return True
+
+    def partValidator(self, partFile: str, url: str) -> str | None:
+        """ETag or Last-Modified of the remote file a .part was downloaded from, if it's still the same url"""
+        try:
+            with open(partFile + '.meta', encoding='utf8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta.get('validator') if meta.get('url') == url else None
+
+    def storePartValidator(self, partFile: str, url: str, headers) -> str | None:
+        """Keeps the validator of a download starting in partFile, returns it"""
+        # Weak ETags can't be used with If-Range
+        etag = headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else headers.get('Last-Modified')
+        if validator:
+            with open(partFile + '.meta', 'w', encoding='utf8') as f:
+                json.dump({'url': url, 'validator': validator}, f)
+        elif os.path.exists(partFile + '.meta'):
+            os.remove(partFile + '.meta')
+        return validator
+
+    def removePartFile(self, partFile: str):
+        """Removes a partial download and its validator"""
+        for path in [partFile, partFile + '.meta']:
+            if os.path.exists(path):
+                os.remove(path)
+
     def downloadToFile(self, destinationFile:str, endpoint: str, params: dict = {}) -> bool:
         """Downloads a file to disk
         If you need to retrieve json or xml, don't use that
         """
-        logging.debug('Trying to download to "%s"' % destinationFile)
-        httpdata = self.download(endpoint, params)
-        if not httpdata['status_code'] == 200:
-            return False
-        # Should go try/catch when writing the file
-        with open(destinationFile,'wb') as f:
-            f.write(httpdata['content'])
-        return True
+        return bool(self.downloadToFileFromUrl(self.buildUrl(endpoint, params), destinationFile, force_download=True))
+
+    def downloadGameAsset(self, media: Media, destination: str, force_mkdir: bool=False, overwrite: bool=False, verify: bool=False):
+        """Download a media asset to disk
 
-    def downloadGameAsset(self, media: Media, destination: str, force_mkdir: bool=False, overwrite: bool=False):
-        """Download a media asset to disk"""
+        With verify, an existing file is only downloaded again if it doesn't match the media hashes
+        """
         logging.info('Downloading media: %s', Asset(media.type).name)
-        self.downloadToFileFromUrl(media.url, destination, force_mkdir, overwrite)
+        blob = self.mediaStore.blobPath(media.hashes, media.extension) if self.mediaStore else None
+        if not blob:
+            self.downloadToFileFromUrl(media.url, destination, force_mkdir, overwrite, media.hashes, verify)
+            return
+        if not self.needsDownload(destination, overwrite, media.hashes, verify):
+            return
+        # The same media may already be stored for another emulator or game
+        with self.mediaStore.blobLock(blob):
+            if not self.mediaStore.has(blob):
+                # The blob is named after the hashes, it can only hold that content
+                stored = self.downloadToFileFromUrl(media.url, blob, True, False, media.hashes, strict_hashes=True)
+                if stored is False:
+                    logging.warning('%s is not stored, downloading it straight to %s', media.url, destination)
+                    self.downloadToFileFromUrl(media.url, destination, force_mkdir, True, media.hashes)
+                    return
+                if not stored:
+                    return
+        if force_mkdir:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        self.mediaStore.linkTo(blob, destination)
+
+    def identifiersFor(self, system = None) -> list:
+        """The rom identifiers to use for a system, in lookup order"""
+        if Platforms.isArcade(system):
+            return self.arcadeRomIdentifiers
+        return self.romIdentifiers
+
+    def platformId(self, system = None) -> str | None:
+        """The scraper platform id of a system, to filter queries on. None if unknown
+
+        systems.py ids come first, then the names of the platforms cache, which
+        is downloaded once if missing.
+        """
+        if not system:
+            return None
+        platformId = Platforms.platformId(system, self.name)
+        if platformId:
+            return platformId
+        with self.platformLock:
+            if not self.platformsIndexed:
+                self.platformsIndexed = True
+                if not self.platformCache:
+                    try:
+                        self.getPlatforms()
+                    except (NotImplementedError, ValueError, KeyError, requests.RequestException) as e:
+                        logging.warning("Couldn't get the %s platforms: %s", self.name, e)
+                if self.platformCache:
+                    Platforms.indexPlatforms(self.name, self.platformEntries())
+        platformId = Platforms.platformId(system, self.name)
+        if not platformId:
+            logging.debug('No %s platform for system %s', self.name, system)
+        return platformId
+
+    def platformEntries(self) -> list:
+        """(platform id, [names]) pairs read from the platforms cache. Up to the child"""
+        return []
+
+    def maxThreads(self) -> int:
+        """How many concurrent queries the backend allows"""
+        return 1
 
     # The following methods MUST be implemented in the child class
     # Gets the complete data for a game and fill the GameInfo object
@@ -2,7 +2,8 @@ import html
 import json
 import logging
 from scrapers.scraper import Scraper
-from classes.gameinfo import GameInfo, Asset, Media, Regions
+from classes.gameinfo import GameInfo, Asset, Media, Regions, internString
+from classes.platforms import Platforms
 
 
 # This list uses the absolute same index as Asset(). It helps setting the
@@ -12,6 +13,9 @@ SSMedia = ['ss', 'video', 'box-texture', 'box-3D', 'box-2D' , 'box-2D-side', 'bo
 
 
 class ScreenScraper(Scraper):
+    # sha1 is only sent when crc and md5 are unknown (CHD files)
+    romIdentifiers = ['crc', 'md5', 'sha1', 'romnom']
+
     def __init__(self, devUser = '', devPassword = '', user = '', password = ''):
         urlParams = 'softname=GroovyScrape&output=json'
         if devUser and devPassword:
@@ -23,26 +27,100 @@ class ScreenScraper(Scraper):
                 , password=password
                 , baseUrl = 'https://www.screenscraper.fr/api2'
                 , baseUrlParams = urlParams)
+        self.userMaxThreads = 0
+
+    def maxThreads(self) -> int:
+        """The number of threads the account is allowed to run, from ssuserInfos.php"""
+        if self.userMaxThreads:
+            return self.userMaxThreads
+        self.userMaxThreads = 1
+        ret = self.download('ssuserInfos.php')
+        if ret and ret['status_code'] == 200:
+            try:
+                self.userMaxThreads = max(int(json.loads(ret['content'])['response']['ssuser']['maxthreads']), 1)
+            except (ValueError, KeyError) as e:
+                logging.warning("Couldn't read the account max threads: %s", e)
+        else:
+            logging.warning("Couldn't get the account information, using a single thread")
+        logging.debug('ScreenScraper account allows %d threads', self.userMaxThreads)
+        return self.userMaxThreads
 
     def getPlatforms(self):
         self.platformCache = json.loads(self.download('systemesListe.php')['content'])
         self.savePlatformsCache()
 
+    def platformEntries(self) -> list:
+        entries = []
+        for p in self.platformCache['response']['systemes']:
+            names = []
+            for n in p['noms'].values():
+                names.extend(n.split(','))
+            entries.append((p['id'], names))
+        return entries
+
+    def combinedQueryParams(self, rom, system = None) -> dict:
+        """All the identifiers of a rom for a single jeuInfos.php query
+
+        md5 and sha1 are only sent when there is no crc: they are not worth hashing
+        the rom when the crc does the job. Whatever was hashed before, the same rom
+        always gets the same parameters, so that its misses are found again.
+        """
+        params = dict()
+        crc = rom.identifier('crc')
+        if crc:
+            params['crc'] = crc
+        else:
+            for h in ['md5', 'sha1']:
+                value = rom.identifier(h)
+                if value:
+                    params[h] = value
+        params['romnom'] = rom.identifier('romnom')
+        romSize = rom.identifier('romtaille')
+        if romSize:
+            params['romtaille'] = romSize
+        systemId = self.platformId(system)
+        if systemId:
+            params['systemeid'] = systemId
+        return params
+
     def queryGameInfo(self, rom, system = None):
         jsData = dict()
-        req_trad = {'crc': rom.crc, 'md5': rom.md5, 'romnom': rom.romfile}
-        if not system in ['mame', 'arcade', 'mame-libretro', 'mame4all', 'fba']:
-            for req_type, req_value in req_trad.items():
-                ret = self.download('jeuInfos.php', {req_type: req_value})
-                logging.debug('%s: URL returned status code %s using %s', rom.romfile, str(ret['status_code']), req_type)
-                if ret['status_code'] == 200:
+        if not Platforms.isArcade(system):
+            # A single request with every identifier. The separate ones are only a
+            # fallback when it errors: a 404 means none of the identifiers is known
+            params = self.combinedQueryParams(rom, system)
+            ret = self.cachedDownload('jeuInfos.php', params, rom.romfile)
+            status = ret.get('status_code') if ret else None
+            logging.debug('%s: URL returned status code %s using a combined query', rom.romfile, status)
+            if status == 200:
+                return json.loads(ret['content'])
+            if status is not None and status != 400 and status < 500:
+                return jsData
+            hashQueried = False
+            for req_type in self.identifiersFor(system):
+                if req_type == 'sha1' and hashQueried:
+                    continue
+                # Hashes are computed here, only if the previous lookups failed
+                req_value = rom.identifier(req_type)
+                if not req_value:
+                    continue
+                hashQueried = hashQueried or req_type in ['crc', 'md5']
+                reqParams = {req_type: req_value}
+                if 'systemeid' in params:
+                    reqParams['systemeid'] = params['systemeid']
+                ret = self.cachedDownload('jeuInfos.php', reqParams, rom.romfile)
+                logging.debug('%s: URL returned status code %s using %s', rom.romfile, ret.get('status_code') if ret else None, req_type)
+                if ret and ret['status_code'] == 200:
                     jsData = json.loads(ret['content'])
                     break
         else:
-            # Force system id to 75 (MAME/arcade)
-            ret = self.download('jeuInfos.php', {'systemid': '75', 'romnom': rom.romfile})
-            logging.debug('%s: URL returned status code %s for system %s', rom.romfile, str(ret['status_code']), system)
-            if ret['status_code'] == 200:
+            params = {'romnom': rom.identifier('romnom')}
+            systemId = self.platformId(system)
+            if systemId:
+                params['systemeid'] = systemId
+            ret = self.cachedDownload('jeuInfos.php', params, rom.romfile)
+            logging.debug('%s: URL returned status code %s for system %s', rom.romfile, ret.get('status_code') if ret else None, system)
+            if ret and ret['status_code'] == 200:
                 jsData = json.loads(ret['content'])
         return jsData
 
@@ -93,14 +171,15 @@ class ScreenScraper(Scraper):
                     if m['type'] in ssm:
                         mediaData.type = SSMedia.index(ssm)
                         break
-            mediaData.hashes['crc32'] = m['crc'] if m['crc'] else None
-            mediaData.hashes['md5'] = m['md5'] if m['md5'] else None
-            mediaData.hashes['sha1'] = m['sha1'] if m['sha1'] else None
+            mediaData.crc32 = m['crc'] if m['crc'] else None
+            mediaData.md5 = m['md5'] if m['md5'] else None
+            mediaData.sha1 = m['sha1'] if m['sha1'] else None
             mediaData.url = m['url']
-            mediaData.scraperMediaType = m['type']
-            mediaData.extension = m['format']
+            # Shared by thousands of medias, keep a single copy of each
+            mediaData.scraperMediaType = internString(m['type'])
+            mediaData.extension = internString(m['format'])
             if 'region' in m:
-                mediaData.region = m['region']
+                mediaData.region = internString(m['region'])
             # logging.debug(mediaData)
             medias.append(mediaData)
         return medias
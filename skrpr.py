@@ -21,20 +21,32 @@
 # MA 02110-1301, USA.
 
 import argparse
+import collections
 import glob
 import os
+import queue
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 import systems
 
 from classes.rom import Rom
-from classes.gameinfo import Asset
+from classes.romcache import RomHashCache
+from classes.rompool import hashRoms, contentKey
+from classes.discimage import groupDiscs
+from classes.platforms import Platforms
+from classes.gameinfo import Asset, GameInfo
+from classes.mediastore import MediaStore
 from frontends.frontend import FrontEnd
 from frontends.attractmode import AttractMode
+from scrapers.downloader import MediaDownloader
 from scrapers.scraper import Scraper
 from scrapers.screenscraper import ScreenScraper
 from scrapers.hfsdb import HFSDB
+from scrapers.offlinedb import OfflineDB
+from classes.datindex import DatIndex
 
 from os import environ as env
 
@@ -75,16 +87,29 @@ parser.add_argument("--video", help="Download video (if avaliable)", action='sto
 parser.add_argument("--wheel", help="Download wheel (if avaliable)", action='store_true')
 
 parser.add_argument("--force", "-f", help="Force rescraping even if the scraped data is already present", action='store_true')
+parser.add_argument("--refresh-media", help="Download again existing medias only if they don't match the scraper checksums", action='store_true')
+parser.add_argument("--media-store", help="Store each unique media once in this dir (default ~/.cache/altscraper/medias) and hardlink artwork files to it", nargs='?', const='', default=None)
 parser.add_argument("--lang", "-l", help="Lang for retrieve game info", default='en')
 parser.add_argument("--region", help="Set region (eu for Europe, us for U.S.A and jp for Japan) for download some media, like wheels or box art. Default is eu", default='eu')
 
 parser.add_argument("--frontend", help="Set the frontend. Only am is available for now", default='am')
 
-parser.add_argument("--scraper", help="Scraping data source (screenscraper, hfsdb, tgdb)", default="screenscraper")
+parser.add_argument("--scraper", help="Scraping data source (screenscraper, hfsdb, offline)", default="screenscraper")
+parser.add_argument("--media-scraper", help="With --scraper offline, online source of the medias (screenscraper, hfsdb)")
+parser.add_argument("--no-disc-grouping", help="Scrape each disc of a multi discs game, instead of the 1st disc or the m3u playlist for all of them", action='store_true')
+parser.add_argument("--clone-reuse", help="Arcade sets: scrape the parents first and build their clones data from them, using the offline index for the parent/clone relationships", action='store_true')
+parser.add_argument("--import-dat", help="Import a MAME -listxml output or a Logiqx DAT (FBNeo ...) in the offline index. Can be used several times", action='append', default=[])
 parser.add_argument("--scraperdir", help="Set the scraper base dir. Default is ~/.attract/scraper/<system>/", default=os.environ['HOME']+"/.attract/scraper")
 
 parser.add_argument('--verbose', '-v', help='Verbose mode. Use multiple times for info/debug (-vv)', action='count', default=0)
 parser.add_argument("--force-cache-systems", help="Force updating the systems cache", action='store_true')
+parser.add_argument("--no-hash-cache", help="Don't use the roms hashes cache, hash every rom again", action='store_true')
+parser.add_argument("--threads", help="Number of concurrent metadata lookups. Default and maximum is what the scraper account allows", type=int, default=0)
+parser.add_argument("--max-rps", help="Maximum number of requests per second sent to the scraper, shared by all threads. Default is no limit besides the server backoff hints", type=float, default=0)
+parser.add_argument("--cache-ttl", help="Days the scraper answers are kept in cache. 0 disables the cache. Default is 30", type=float, default=30)
+parser.add_argument("--miss-ttl", help="Days a lookup that found nothing is not tried again. Default is 7", type=float, default=7)
+parser.add_argument("--download-workers", help="Number of media downloads running next to the metadata lookups. Default is 2", type=int, default=2)
+parser.add_argument("--hash-workers", help="Number of processes hashing roms. Default is the number of CPUs", type=int, default=0)
 
 parser.add_argument("--emulator", "-e", help="An AttractMode emulator configuration file")
 
@@ -107,6 +132,63 @@ parser.add_argument("--password", "-p", help="Your screenScraper password.")
 args = parser.parse_args()
 
 
+def download_rom_medias(my_fe: FrontEnd, downloader: MediaDownloader, current_rom: Rom, rom_info: GameInfo, medias_to_scrape: list):
+    """Queue the wanted medias of a scraped rom for download to the frontend artwork dirs"""
+    for media in medias_to_scrape:
+        if not my_fe.artworkPath[media.value]:
+            logging.error('Frontend has no dir set for media type %s, skipping', media)
+            continue
+        if not media.value in my_fe.artworkPath:
+            logging.error('Media value %s is not handled by the FrontEnd, skipping', media)
+            continue
+        media_asset = rom_info.getAssetMedia(media)
+        if not media_asset:
+            logging.error('Media %s is not available for the rom, slipping', media)
+            continue
+        dest_dir = ''
+        # This is absolutely lame, really ...
+        logging.debug(my_fe.artworkPath[media.value])
+        # for folder_path in my_fe.artworkPath[media.value]:
+        #     if os.access(folder_path, os.W_OK):
+        #         dest_dir = folder_path
+        #         break
+        dest_dir = my_fe.artworkPath[media.value][0]
+        # getAssetMedia can return None, this code is not safe
+        media_destination_file = '%s/%s.%s' % (dest_dir,
+            current_rom.romname,
+            media_asset.extension)
+        downloader.submit(media_asset, media_destination_file, True, args.force, args.refresh_media)
+
+
+def make_scraper(name: str) -> Scraper:
+    if name == 'screenscraper':
+        return ScreenScraper(devUser = env['SS_DEVUSER'],
+                devPassword = env['SS_DEVPASSWD'],
+                user = args.user,
+                password = args.password)
+    if name == 'hfsdb':
+        return HFSDB(user = env['HFSDB_USER'], password = env['HFSDB_PASSWD'])
+    return Scraper()
+
+
+def derive_clone_info(my_scraper: Scraper, parent_lookup, current_rom: Rom, system: str, clone: dict) -> GameInfo | None:
+    """Builds a clone game info from its parent one, only the DAT fields of the clone differ"""
+    parent_info = parent_lookup.result()
+    if not parent_info:
+        return my_scraper.getGameInfo(current_rom, system)
+    logging.debug('%s: derived from its parent %s', current_rom.romname, clone['cloneof'])
+    overrides = {'cloneof': clone['cloneof'], 'title': {'wor': clone['description']}}
+    if clone['year']:
+        overrides['date'] = {'wor': clone['year']}
+    if clone['manufacturer']:
+        overrides['developer'] = clone['manufacturer']
+    if clone['players']:
+        overrides['players'] = clone['players']
+    if clone['rotate'] is not None:
+        overrides['rotation'] = clone['rotate']
+    return parent_info.derive(**overrides)
+
+
 def go_and_scrape(medias_to_scrape: list):
     # Initialize the right front end class
     rom_list_file = ''
@@ -115,21 +197,29 @@ def go_and_scrape(medias_to_scrape: list):
         emulator_no_ext = os.path.splitext(os.path.basename(args.emulator))[0]
         rom_list_file = args.romlist_file if args.romlist_file else '%s/%s.txt' % (roms_lists_directory, emulator_no_ext)
     my_fe = FrontEnd()
-    my_scraper = Scraper()
 
     if args.frontend == 'am':
         my_fe = AttractMode(cfgFile=args.emulator, am_home_path=args.frontend_homedir)
 
-    if args.scraper == 'screenscraper':
-        my_scraper = ScreenScraper(devUser = env['SS_DEVUSER'],
-                devPassword = env['SS_DEVPASSWD'],
-                user = args.user,
-                password = args.password)
+    if args.scraper == 'offline':
+        # Online backends are only needed for the medias
+        media_scraper = make_scraper(args.media_scraper) if args.media_scraper and medias_to_scrape else None
+        my_scraper = OfflineDB(mediaScraper=media_scraper)
+    else:
+        my_scraper = make_scraper(args.scraper)
 
-    if args.scraper == 'hfsdb':
-        my_scraper = HFSDB(user = env['HFSDB_USER'], password = env['HFSDB_PASSWD'])
+    # Emulators can have any system name, the roms extensions may tell which one it is
+    if not Platforms.resolve(my_fe.system):
+        guessed_system = Platforms.guessSystem(my_fe.romexts)
+        if guessed_system:
+            logging.info('Unknown system %s, scraping as %s according to the roms extensions', my_fe.system, guessed_system)
+            my_fe.system = guessed_system
+        else:
+            logging.warning('Unknown system %s, queries will not be filtered on a platform', my_fe.system)
 
     logging.info('Scrape source: %s', my_scraper.name)
+    if args.force_cache_systems:
+        my_scraper.getPlatforms()
 
     # Get roms
     files = []
@@ -145,43 +235,159 @@ def go_and_scrape(medias_to_scrape: list):
         logging.critical('No roms found')
         return 1
 
-    # Start scraping
-    for file in sorted(files):
-        # Get game info
-        # According to parameters, download the right data
-        current_rom = Rom(file)
-        logging.info('Scraping %s as system %s ...' % (current_rom.romfile, my_fe.system))
-        rom_info = my_scraper.getGameInfo(current_rom, my_fe.system)
-        # if rom_info:
-            # logging.debug("Filtered som:\n%s", rom_info.filterOnLang('fr'))
-        if not rom_info:
-            logging.warning('No data found for rom')
+    hash_cache = None if args.no_hash_cache else RomHashCache()
+
+    # Parent/clone relationships of the arcade sets, parents are scraped first
+    clones = dict()
+    if args.clone_reuse:
+        dat_index = DatIndex()
+        for f in files:
+            game = dat_index.lookup(os.path.splitext(os.path.basename(f))[0])
+            if game and game['cloneof']:
+                clones[game['name']] = game
+        if not dat_index.count():
+            logging.warning('--clone-reuse needs parent/clone data, import a MAME -listxml or a DAT with --import-dat')
+        files.sort(key=lambda f: (os.path.splitext(os.path.basename(f))[0] in clones, f))
+    else:
+        files.sort()
+
+    # Discs of a game share all their data, only the 1st one (or the m3u playlist) is looked up
+    disc_groups = dict() if args.no_disc_grouping else groupDiscs(files)
+    if disc_groups:
+        grouped_discs = sum(len(g) for g in disc_groups.values())
+        if grouped_discs:
+            logging.info('%d discs grouped with the 1st disc of their game', grouped_discs)
+        files = [f for f in files if f in disc_groups]
+
+    # As many metadata lookups in flight as the scraper account allows
+    lookup_threads = my_scraper.maxThreads()
+    if args.threads:
+        lookup_threads = min(args.threads, lookup_threads)
+    # Lookups and media downloads share the HTTP connections pool
+    media_store = MediaStore(args.media_store) if args.media_store is not None else None
+    # The offline backend sends its online requests through its media scraper
+    for scraper in [my_scraper, getattr(my_scraper, 'mediaScraper', None)]:
+        if not scraper:
             continue
-        my_fe.romlist[current_rom] = rom_info.filterOnLang(args.lang)
-        for media in medias_to_scrape:
-            if not my_fe.artworkPath[media.value]:
-                logging.error('Frontend has no dir set for media type %s, skipping', media)
+        scraper.setPoolSize(lookup_threads + args.download_workers)
+        if args.max_rps:
+            scraper.rateLimiter.setRate(args.max_rps)
+        scraper.setResponseCacheTtl(args.cache_ttl * 24 * 3600)
+        scraper.missTtl = args.miss_ttl * 24 * 3600
+        scraper.ignoreMisses = args.force
+        scraper.mediaStore = media_store
+    logging.info('Using %d concurrent lookups and %d download workers', lookup_threads, args.download_workers)
+
+    # Start scraping, roms come from the hashing stage as soon as they are hashed.
+    # Finished lookups feed the download stage while other lookups are in flight,
+    # and while the next roms are still being hashed
+    scraped_roms = dict()
+    lookups = dict()
+    parent_lookups = dict()
+    derived_clones = 0
+    # Roms sharing the same content, or discs of the same game, are looked up
+    # once, the result fans out to all of them
+    identifiers = my_scraper.identifiersFor(my_fe.system)
+    dumps = dict() # content key -> roms
+    dump_infos = dict() # content key -> the game info of the dump, once known
+    lookup_keys = dict()
+    lookup_roms = dict() # lookup -> all the roms getting its result
+    duplicates = 0
+    # Hashed roms and completed lookups, handled in this thread as they come
+    events = queue.Queue()
+    handled_lookups = 0
+
+    def hash_roms():
+        try:
+            for current_rom in hashRoms(files, identifiers, args.hash_workers, hash_cache):
+                events.put(('rom', current_rom))
+        except Exception as e:
+            events.put(('error', e))
+        finally:
+            events.put(('hashed', None))
+
+    def handle_lookup(lookup):
+        current_rom = lookups[lookup]
+        key = lookup_keys.get(lookup)
+        try:
+            rom_info = lookup.result()
+        except Exception as e:
+            logging.error('Scraping %s failed: %s', current_rom.romfile, e)
+            return
+        if not rom_info:
+            logging.warning('No data found for rom %s', current_rom.romfile)
+            return
+        if key:
+            dump_infos[key] = rom_info
+        # Only the romlist data is kept until the end, not every media of the game
+        filtered_info = rom_info.filterOnLang(args.lang)
+        for rom in lookup_roms[lookup]:
+            scraped_roms[rom] = filtered_info
+            download_rom_medias(my_fe, downloader, rom, rom_info, medias_to_scrape)
+
+    with MediaDownloader(my_scraper, args.download_workers) as downloader, \
+            ThreadPoolExecutor(max_workers=lookup_threads) as executor:
+        threading.Thread(target=hash_roms, name='hashing', daemon=True).start()
+        hashing = True
+        while hashing or handled_lookups < len(lookups):
+            event, value = events.get()
+            if event == 'lookup':
+                handle_lookup(value)
+                handled_lookups += 1
                 continue
-            if not media.value in my_fe.artworkPath:
-                logging.error('Media value %s is not handled by the FrontEnd, skipping', media)
+            if event == 'error':
+                raise value
+            if event == 'hashed':
+                hashing = False
                 continue
-            media_asset = rom_info.getAssetMedia(media)
-            if not media_asset:
-                logging.error('Media %s is not available for the rom, slipping', media)
+            current_rom = value
+            key = contentKey(current_rom, identifiers)
+            rom_group = [current_rom] + [Rom(f, hashCache=hash_cache) for f in disc_groups.get(current_rom.rompathname, [])]
+            if key in dumps:
+                logging.info('%s is the same dump as %s, not looked up again', current_rom.romfile, dumps[key][0].romfile)
+                dumps[key].extend(rom_group)
+                duplicates += 1
+                if key in dump_infos:
+                    filtered_info = dump_infos[key].filterOnLang(args.lang)
+                    for rom in rom_group:
+                        scraped_roms[rom] = filtered_info
+                        download_rom_medias(my_fe, downloader, rom, dump_infos[key], medias_to_scrape)
                 continue
-            dest_dir = ''
-            # This is absolutely lame, really ...
-            logging.debug(my_fe.artworkPath[media.value])
-            # for folder_path in my_fe.artworkPath[media.value]:
-            #     if os.access(folder_path, os.W_OK):
-            #         dest_dir = folder_path
-            #         break
-            dest_dir = my_fe.artworkPath[media.value][0]
-            # getAssetMedia can return None, this code is not safe
-            media_destination_file = '%s/%s.%s' % (dest_dir,
-                current_rom.romname,
-                media_asset.extension)
-            my_scraper.downloadGameAsset(media_asset, media_destination_file, True, args.force)
+            clone = clones.get(current_rom.romname)
+            if clone and clone['cloneof'] in parent_lookups:
+                # Parents are submitted first, so a worker never waits for a lookup that isn't running
+                lookup = executor.submit(derive_clone_info, my_scraper, parent_lookups[clone['cloneof']], current_rom, my_fe.system, clone)
+                derived_clones += 1
+            else:
+                logging.info('Scraping %s as system %s ...' % (current_rom.romfile, my_fe.system))
+                lookup = executor.submit(my_scraper.getGameInfo, current_rom, my_fe.system)
+                parent_lookups[current_rom.romname] = lookup
+            lookups[lookup] = current_rom
+            lookup_roms[lookup] = rom_group
+            if key:
+                dumps[key] = rom_group
+                lookup_keys[lookup] = key
+            lookup.add_done_callback(lambda done: events.put(('lookup', done)))
+
+    # Lookups complete in any order, keep the romlist deterministic
+    for current_rom in sorted(scraped_roms, key=lambda r: r.rompathname):
+        my_fe.romlist[current_rom] = scraped_roms[current_rom]
+
+    if duplicates:
+        logging.info('%d roms were duplicates of another dump, not looked up', duplicates)
+    if args.clone_reuse:
+        logging.info('%d clones built from their parent data', derived_clones)
+    if hash_cache:
+        logging.info('Rom hashes cache: %d hits, %d misses', hash_cache.hits, hash_cache.misses)
+    logging.info(my_scraper.cacheStats())
+    if my_scraper.mediaStore:
+        logging.info('Media store: %d medias reused, %d new', my_scraper.mediaStore.hits, my_scraper.mediaStore.misses)
+    suppressed_roms = my_scraper.suppressedRoms()
+    if suppressed_roms:
+        logging.info('%d roms were not looked up again, %s had nothing for them recently (use --force to retry):',
+            len(suppressed_roms), my_scraper.name)
+        for romfile in suppressed_roms:
+            logging.info('  %s', romfile)
 
     # Time to take care of romlist update
     if args.romlist_update:
@@ -189,7 +395,7 @@ def go_and_scrape(medias_to_scrape: list):
         my_fe.update_rom_list(rom_list_file)
     elif not args.no_romlist_update:
         # Write the whole romlist
-        loging.info('Writing the romlist...')
+        logging.info('Writing the romlist...')
         my_fe.write_rom_list(rom_list_file)
 
 
@@ -249,9 +455,15 @@ if __name__ == '__main__':
     if not load_dotenv(verbose=True):
         logging.warning("Couldn't load_dotenv()")
 
+    if args.import_dat:
+        dat_index = DatIndex()
+        for dat_file in args.import_dat:
+            dat_index.importDat(dat_file)
+        dat_index.close()
+
     if args.emulator or (args.system and args.romsdir):
         # Scrapper()
         go_and_scrape(medias_to_scrape)
         logging.info('Scraping over!')
-    else:
+    elif not args.import_dat:
         parser.print_help()
@@ -1,24 +1,28 @@
 # In this file all roms extensions for 
+# ids are the platform ids of each scraper, when they are known. Missing ones
+# are looked up in the scraper platforms cache by name and aliases.
+# aliases are other names used for the system, like the AttractMode one.
+# arcade systems are identified by their romset name, not by hashes
 systems = {}
 
-systems['dreamcast'] = {'name': 'Dreamcats', 'exts': ['cdi', 'gdi']}
-systems['megadrive'] = {'name': 'Sega Mega Drive/Genesis', 'exts': ['smd', 'bin', 'md', 'iso']}
-systems['mastersystem'] = {'name': 'Sega Master System', 'exts': ['sms']}
-systems['nes'] = {'name': 'Nintendo Entertaiment System (NES)/Famicom', 'exts': ['zip', 'nes', 'smc', 'sfc', 'fig', 'swc', 'mgd']}
-systems['snes'] = {'name': 'Super Nintendo/Famicom', 'exts': ['zip', 'smc', 'sfc', 'fig', 'swc']}
-systems['n64'] = {'name': 'Nintendo 64', 'exts': ['z64', 'n64', 'v64']}
-systems['psx'] = {'name': 'Sony Playstation/PS One', 'exts': ['cue', 'cbn', 'img', 'iso', 'm3u', 'mdf', 'pbp', 'toc', 'z', 'znx']}
-systems['sega32x'] = {'name': 'Sega 32X', 'exts': ['32x', 'smd', 'bin', 'md']}
-systems['segacd'] = {'name': 'Sega CD', 'exts': ['cue', 'iso']}
-systems['zxspectrum'] = {'name': 'Zx Spectrum', 'exts': ['sna', 'szx', 'z80', 'tap', 'tzx', 'gz', 'udi', 'mgt', 'img', 'trd', 'scl', 'dsk']}
-systems['ngp'] = {'name': 'Neo Geo Pocket', 'exts': ['ngp']}
-systems['ngpc'] = {'name': 'Neo Geo Pocket Color', 'exts': ['ngc']}
-systems['gb'] = {'name': 'Game Boy', 'exts': ['gb']}
-systems['gbc'] = {'name': 'Game Boy Color', 'exts': ['gbc']}
-systems['gba'] = {'name': 'Game Boy Advance', 'exts': ['gba']}
-systems['mame-libretro'] = {'name': 'RetroArch MAME core', 'exts': ['zip']}
-systems['mame-mame4all'] = {'name': 'MAME 4 All', 'exts': ['zip']}
-systems['mame'] = {'name': 'MAME', 'exts': ['zip']}
-systems['fba'] = {'name': 'Final Burn Alpha', 'exts': ['zip']}
-systems['arcade'] = {'name': 'Arcade systems (MAME, FBA, Neo Geo)', 'exts': ['zip']}
-systems['pcengine'] = {'name': 'PC-Engine/TurboGrafx-16', 'exts': ['pce', 'cue', 'zip']}
+systems['dreamcast'] = {'name': 'Dreamcats', 'exts': ['cdi', 'gdi'], 'ids': {'ScreenScraper': 23}, 'aliases': ['Sega Dreamcast']}
+systems['megadrive'] = {'name': 'Sega Mega Drive/Genesis', 'exts': ['smd', 'bin', 'md', 'iso'], 'ids': {'ScreenScraper': 1}, 'aliases': ['genesis', 'Sega Mega Drive', 'Sega Genesis']}
+systems['mastersystem'] = {'name': 'Sega Master System', 'exts': ['sms'], 'ids': {'ScreenScraper': 2}, 'aliases': ['sms']}
+systems['nes'] = {'name': 'Nintendo Entertaiment System (NES)/Famicom', 'exts': ['zip', 'nes', 'smc', 'sfc', 'fig', 'swc', 'mgd'], 'ids': {'ScreenScraper': 3}, 'aliases': ['famicom', 'Nintendo Entertainment System']}
+systems['snes'] = {'name': 'Super Nintendo/Famicom', 'exts': ['zip', 'smc', 'sfc', 'fig', 'swc'], 'ids': {'ScreenScraper': 4}, 'aliases': ['sfc', 'Super Nintendo', 'Super Famicom']}
+systems['n64'] = {'name': 'Nintendo 64', 'exts': ['z64', 'n64', 'v64'], 'ids': {'ScreenScraper': 14}}
+systems['psx'] = {'name': 'Sony Playstation/PS One', 'exts': ['cue', 'cbn', 'img', 'iso', 'm3u', 'mdf', 'pbp', 'toc', 'z', 'znx'], 'ids': {'ScreenScraper': 57}, 'aliases': ['ps1', 'Sony Playstation', 'Playstation']}
+systems['sega32x'] = {'name': 'Sega 32X', 'exts': ['32x', 'smd', 'bin', 'md'], 'ids': {'ScreenScraper': 19}, 'aliases': ['32x']}
+systems['segacd'] = {'name': 'Sega CD', 'exts': ['cue', 'iso'], 'ids': {'ScreenScraper': 20}, 'aliases': ['megacd', 'Sega Mega-CD']}
+systems['zxspectrum'] = {'name': 'Zx Spectrum', 'exts': ['sna', 'szx', 'z80', 'tap', 'tzx', 'gz', 'udi', 'mgt', 'img', 'trd', 'scl', 'dsk'], 'ids': {'ScreenScraper': 76}}
+systems['ngp'] = {'name': 'Neo Geo Pocket', 'exts': ['ngp'], 'ids': {'ScreenScraper': 25}}
+systems['ngpc'] = {'name': 'Neo Geo Pocket Color', 'exts': ['ngc'], 'ids': {'ScreenScraper': 82}}
+systems['gb'] = {'name': 'Game Boy', 'exts': ['gb'], 'ids': {'ScreenScraper': 9}}
+systems['gbc'] = {'name': 'Game Boy Color', 'exts': ['gbc'], 'ids': {'ScreenScraper': 10}}
+systems['gba'] = {'name': 'Game Boy Advance', 'exts': ['gba'], 'ids': {'ScreenScraper': 12}}
+systems['mame-libretro'] = {'name': 'RetroArch MAME core', 'exts': ['zip'], 'ids': {'ScreenScraper': 75}, 'arcade': True}
+systems['mame-mame4all'] = {'name': 'MAME 4 All', 'exts': ['zip'], 'ids': {'ScreenScraper': 75}, 'arcade': True, 'aliases': ['mame4all']}
+systems['mame'] = {'name': 'MAME', 'exts': ['zip'], 'ids': {'ScreenScraper': 75}, 'arcade': True}
+systems['fba'] = {'name': 'Final Burn Alpha', 'exts': ['zip'], 'ids': {'ScreenScraper': 75}, 'arcade': True, 'aliases': ['fbneo', 'Final Burn Neo']}
+systems['arcade'] = {'name': 'Arcade systems (MAME, FBA, Neo Geo)', 'exts': ['zip'], 'ids': {'ScreenScraper': 75}, 'arcade': True}
+systems['pcengine'] = {'name': 'PC-Engine/TurboGrafx-16', 'exts': ['pce', 'cue', 'zip'], 'ids': {'ScreenScraper': 31}, 'aliases': ['pce', 'tg16', 'TurboGrafx-16', 'NEC PC Engine']}
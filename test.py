@@ -1,17 +1,31 @@
 """Tests for possible scrapers
 """
+import binascii
+import hashlib
+import http.server
 import json
 import logging
 import os
+import struct
 import sys
+import tempfile
+import threading
+import time
+import zipfile
 from os import environ as env
 
+import py7zr
 import requests
 from dotenv import load_dotenv
 
 from classes.rom import Rom
+from classes.discimage import cueDataTrack, gdiDataTrack, readChdSha1, resolveDataTrack, discNumber, groupDiscs
 from classes.gameinfo import Asset
+from classes.datindex import iterDatGames
+from classes.platforms import PlatformRegistry
 from scrapers.hfsdb import HFSDB
+from scrapers.ratelimiter import RateLimiter, retryDelay
+from scrapers.responsecache import normalizeParams
 from scrapers.scraper import Scraper
 from scrapers.screenscraper import ScreenScraper
 from scrapers.thegamesdb import TheGamesDb
@@ -31,6 +45,164 @@ def download_zips():
             continue
         open('tests/' + f, 'wb').write(r.content)
 
+def test_rom():
+    """Test the single pass hashing of the Rom class on single and multi members archives"""
+    members = {'game.bin': os.urandom(70000), 'game.cue': b'FILE "game.bin" BINARY\n'}
+    with tempfile.TemporaryDirectory() as d:
+        for name, content in members.items():
+            open(os.path.join(d, name), 'wb').write(content)
+        for archive, names in [['single', ['game.bin']], ['multi', list(members)]]:
+            with zipfile.ZipFile(os.path.join(d, archive + '.zip'), 'w', zipfile.ZIP_DEFLATED) as z:
+                for name in names:
+                    z.write(os.path.join(d, name), name)
+            with py7zr.SevenZipFile(os.path.join(d, archive + '.7z'), 'w') as z:
+                for name in names:
+                    z.write(os.path.join(d, name), name)
+            for ext in ['zip', '7z']:
+                rom = Rom(os.path.join(d, archive + '.' + ext))
+                # A single member archive is identified by its member, otherwise by the archive itself
+                if archive == 'single':
+                    data = members['game.bin']
+                    assert rom.crc == format(binascii.crc32(data), '08x')
+                else:
+                    data = open(rom.rompathname, 'rb').read()
+                    assert not rom.crc
+                assert rom.md5 == hashlib.md5(data).hexdigest()
+                assert rom.sha1 == hashlib.sha1(data).hexdigest()
+                assert rom.hashThroughput > 0
+                # Each member has its own CRC, not the one of the first member
+                crcs = {name: int(crc, 16) for member in rom.archiveContent for name, crc in member.items()}
+                assert crcs == {name: binascii.crc32(members[name]) for name in names}
+
+def test_discimage():
+    """Test the cue/gdi/m3u data track resolution and the CHD header SHA1"""
+    with tempfile.TemporaryDirectory() as d:
+        for track in ['Game (Track 1).bin', 'Game (Track 2).bin', 'track01.bin', 'track 03.bin']:
+            open(os.path.join(d, track), 'wb').write(b'\0' * 16)
+        with open(os.path.join(d, 'Game.cue'), 'w') as f:
+            # A lone quote in a comment must not break the parsing
+            f.write("REM Tony's rip\nFILE \"Game (Track 1).bin\" BINARY\n  TRACK 01 AUDIO\n"
+                "FILE \"Game (Track 2).bin\" BINARY\n  TRACK 02 MODE1/2352\n    INDEX 01 00:00:00\n")
+        assert cueDataTrack(os.path.join(d, 'Game.cue')) == 'Game (Track 2).bin'
+        with open(os.path.join(d, 'Game.gdi'), 'w') as f:
+            f.write('3\n1 0 4 2352 track01.bin 0\n2 600 0 2352 "track 02.raw" 0\n3 45000 4 2352 "track 03.bin" 0\n')
+        assert gdiDataTrack(os.path.join(d, 'Game.gdi')) == 'track 03.bin'
+        with open(os.path.join(d, 'Game.m3u'), 'w') as f:
+            f.write('# Playlist\nGame.cue\n')
+        assert resolveDataTrack(os.path.join(d, 'Game.m3u')) == os.path.join(d, 'Game (Track 2).bin')
+        rom = Rom(os.path.join(d, 'Game.cue'))
+        assert rom.md5 == hashlib.md5(b'\0' * 16).hexdigest()
+        sha1 = bytes(range(20))
+        header = b'MComprHD' + struct.pack('>II', 124, 5) + b'\0' * 68 + sha1 + b'\0' * 20
+        open(os.path.join(d, 'Game.chd'), 'wb').write(header)
+        assert readChdSha1(os.path.join(d, 'Game.chd')) == sha1.hex()
+
+def test_groupdiscs():
+    """Test the multi discs games grouping"""
+    assert discNumber('/roms/Game (USA) (Disc 2).cue') == (('/roms', 'game (usa)', '.cue'), 2)
+    assert discNumber('/roms/Game (Disc 1 of 3).chd')[1] == 1
+    assert discNumber('/roms/Game [CD2].iso')[1] == 2
+    assert discNumber('/roms/Game (Disk B).dsk')[1] == 2
+    # Platform tags aren't disc numbers
+    assert discNumber('/roms/Mortal Kombat (CD32).iso') is None
+    assert discNumber('/roms/Hotel Mario (CDi).iso') is None
+    assert discNumber('/roms/Game (CD-i).iso') is None
+    with tempfile.TemporaryDirectory() as d:
+        names = ['FF7 (Disc 2).cue', 'FF7 (Disc 1).cue', 'FF7 (Disc 3).cue', 'Solo.cue',
+            'MGS (Disc 1).chd', 'MGS (Disc 2).chd', 'Mortal Kombat (CD32).iso']
+        files = [os.path.join(d, n) for n in names]
+        for f in files:
+            open(f, 'w').close()
+        with open(os.path.join(d, 'MGS.m3u'), 'w') as f:
+            f.write('MGS (Disc 1).chd\nMGS (Disc 2).chd\n')
+        files.append(os.path.join(d, 'MGS.m3u'))
+        groups = groupDiscs(files)
+        assert groups[os.path.join(d, 'FF7 (Disc 1).cue')] == [os.path.join(d, 'FF7 (Disc 2).cue'), os.path.join(d, 'FF7 (Disc 3).cue')]
+        assert groups[os.path.join(d, 'MGS.m3u')] == [os.path.join(d, 'MGS (Disc 1).chd'), os.path.join(d, 'MGS (Disc 2).chd')]
+        assert groups[os.path.join(d, 'Solo.cue')] == []
+        assert groups[os.path.join(d, 'Mortal Kombat (CD32).iso')] == []
+        assert len(groups) == 4
+
+def test_ratelimiter():
+    """Test the workers resume one by one after a server backoff, with or without a budget"""
+    for rps in [0, 5]:
+        limiter = RateLimiter(rps)
+        start = time.monotonic()
+        limiter.backoff(0.3)
+        resumed = []
+        threads = [threading.Thread(target=lambda: (limiter.acquire(), resumed.append(time.monotonic() - start)))
+            for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        resumed.sort()
+        assert resumed[0] >= 0.29
+        gaps = [b - a for a, b in zip(resumed, resumed[1:])]
+        assert min(gaps) >= 0.15, gaps
+    # Back to no limit once a request went through
+    limiter = RateLimiter()
+    limiter.backoff(0.01)
+    limiter.success()
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+    assert retryDelay({'Retry-After': '2'}) == 2
+    assert retryDelay({'X-Ratelimit-Retryafter': '1500ms'}) == 1.5
+    assert retryDelay({}) == 0
+
+def test_responsecache():
+    """Test the metadata cache keys don't depend on the params order or the hashes case"""
+    assert normalizeParams({'crc': 'ABCD1234', 'systemeid': 1}) == normalizeParams({'systemeid': '1', 'crc': 'abcd1234'})
+    # Rom names are case sensitive
+    assert normalizeParams({'romnom': 'Game.zip'}) != normalizeParams({'romnom': 'game.zip'})
+
+def test_datindex():
+    """Test the MAME -listxml and Logiqx DAT parsing"""
+    with tempfile.TemporaryDirectory() as d:
+        listxml = os.path.join(d, 'mame.xml')
+        with open(listxml, 'w') as f:
+            f.write('<?xml version="1.0"?><mame build="0.260">'
+                '<machine name="puckman"><description>PuckMan (Japan set 1)</description><year>1980</year>'
+                '<manufacturer>Namco</manufacturer><display type="raster" rotate="90"/><input players="2"/></machine>'
+                '<machine name="pacman" cloneof="puckman"><description>Pac-Man (Midway)</description><year>1980</year>'
+                '<manufacturer>Namco (Midway license)</manufacturer></machine>'
+                '<machine name="z80" isdevice="yes" runnable="no"><description>Zilog Z80</description></machine></mame>')
+        games = {g['name']: g for g in iterDatGames(listxml)}
+        assert sorted(games) == ['pacman', 'puckman']
+        assert games['puckman']['rotate'] == 90 and games['puckman']['players'] == '2'
+        assert games['pacman']['cloneof'] == 'puckman' and games['pacman']['year'] == '1980'
+        # No display element, the clone rotation is unknown rather than 0
+        assert games['pacman']['rotate'] is None
+        dat = os.path.join(d, 'fbneo.dat')
+        with open(dat, 'w') as f:
+            f.write('<?xml version="1.0"?><datafile><header><name>FBNeo</name></header>'
+                '<game name="1942"><description>1942</description><year>1984</year><manufacturer>Capcom</manufacturer>'
+                '<video orientation="vertical"/></game></datafile>')
+        games = list(iterDatGames(dat))
+        assert len(games) == 1 and games[0]['rotate'] == 90 and games[0]['cloneof'] == ''
+
+def test_platforms():
+    """Test the systems registry resolution"""
+    platforms = PlatformRegistry()
+    assert platforms.resolve('Sega Genesis') == 'megadrive'
+    assert platforms.resolve('Arcade;MAME') == 'arcade'
+    assert platforms.resolve('Unknown') is None
+    assert platforms.isArcade('fba') and not platforms.isArcade('snes')
+    assert platforms.platformId('Nintendo Entertainment System', 'ScreenScraper') == '3'
+    assert platforms.platformId('nes', 'HFSDB') is None
+    platforms.indexPlatforms('HFSDB', [(12, ['NES', 'Nintendo Entertainment System'])])
+    assert platforms.platformId('famicom', 'HFSDB') == '12'
+    # Disc images and archives are used by many systems, some unknown to systems.py
+    assert platforms.guessSystem(['cue', 'm3u']) is None
+    assert platforms.guessSystem(['iso', 'cue', 'm3u']) is None
+    assert platforms.guessSystem(['gba', 'zip']) == 'gba'
+    assert platforms.guessSystem(['gb', 'gba']) is None
+    # smd is also a 32X extension
+    assert platforms.guessSystem(['smd', 'md']) is None
+    assert platforms.guessSystem(['zip']) is None
+
 def test_scraper():
     """Test the Scraper base class"""
     my_scraper = Scraper(name = 'ScraperTest',
@@ -43,6 +215,56 @@ def test_scraper():
                 password = 'anotherPass')
     logging.info(vars(my_scraper))
 
+def test_partdownload():
+    """Test the resume of partial downloads against a local HTTP server"""
+    content = {'etag': '"v2"', 'data': os.urandom(50000)}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = content['data']
+            offset = int(self.headers.get('Range', 'bytes=0-')[6:-1])
+            if self.headers.get('If-Range', content['etag']) != content['etag']:
+                offset = 0
+            if offset >= len(data) and offset:
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206 if offset else 200)
+            if offset:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (offset, len(data) - 1, len(data)))
+            self.send_header('ETag', content['etag'])
+            self.send_header('Content-Length', str(len(data) - offset))
+            self.end_headers()
+            self.wfile.write(data[offset:])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/media.png' % server.server_port
+    my_scraper = Scraper(name = 'ScraperTest', baseUrl = url)
+    with tempfile.TemporaryDirectory() as d:
+        destination = os.path.join(d, 'media.png')
+
+        def download(part: bytes, validator: str | None) -> bytes:
+            open(destination + '.part', 'wb').write(part)
+            if validator:
+                with open(destination + '.part.meta', 'w') as f:
+                    json.dump({'url': url, 'validator': validator}, f)
+            assert my_scraper.downloadToFileFromUrl(url, destination, force_download=True)
+            assert not os.path.exists(destination + '.part.meta')
+            return open(destination, 'rb').read()
+
+        # Same remote file: resumed
+        assert download(content['data'][:1000], '"v2"') == content['data']
+        # The remote file changed since the .part was started
+        assert download(os.urandom(1000), '"v1"') == content['data']
+        # A .part from a previous run can't be checked without a validator or hashes
+        assert download(os.urandom(1000), None) == content['data']
+        assert download(os.urandom(len(content['data'])), None) == content['data']
+    server.shutdown()
+
 def test_screenscraper():
     """Test the ScreenScraper Scraper class"""
     my_sscraper = ScreenScraper(devUser = env['SS_DEVUSER'],
@@ -111,7 +333,15 @@ if not load_dotenv(verbose=True):
     logging.warning("Couldn't load_dotenv()")
 
 download_zips()
+test_rom()
+test_discimage()
+test_groupdiscs()
+test_ratelimiter()
+test_responsecache()
+test_datindex()
+test_platforms()
 test_scraper()
+test_partdownload()
 # test_screenscraper()
 # test_tgdb()
 test_hfsdb()